@@ -0,0 +1,337 @@
+'''
+    asyncio transport for ServerManager.
+
+    Handlers declared with async def run as tasks on the event loop, so
+    thousands of pending requests cost no threads. Plain handlers keep
+    working and run in an executor: a single thread for EDITOR messages,
+    to keep their order, and a pool of max_workers threads for the rest.
+'''
+import asyncio
+import functools
+import inspect
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from .codec import get_codec
+from .exception import JsonRpcContentModified, JsonRpcInvalidParams, JsonRpcRequestCancelled
+from .manager import ServerManager, ClientRequestRecord, _accepts_token
+from .methodMap import WorkerType
+from . import constant as ct
+
+logger = logging.getLogger(__name__)
+
+
+def _is_async(handler) -> bool:
+    if isinstance(handler, functools.partial):
+        handler = handler.func
+    return inspect.iscoroutinefunction(handler)
+
+
+class AsyncJsonRpcStreamReader:
+    def __init__(self, reader: asyncio.StreamReader, codec=None):
+        self._reader = reader
+        self._codec = codec or get_codec()
+
+    async def read_message(self):
+        '''
+            returns a json, or None at the end of the stream
+        '''
+        while True:
+            body = await self.read_frame()
+            if body is None:
+                return None
+            message = self.decode(body)
+            if message is not None:
+                return message
+
+    async def read_frame(self):
+        '''
+            returns the undecoded body of a message, or None at the end of
+            the stream
+        '''
+        while True:
+            try:
+                header = await self._reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return None
+            content_length = None
+            for line in header.split(b'\r\n'):
+                if line.startswith(b'Content-Length:'):
+                    content_length = int(line[len(b'Content-Length:'):])
+            if content_length is None:
+                logger.error('Missing Content-Length header: %s', header)
+                continue
+            try:
+                return await self._reader.readexactly(content_length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return None
+
+    def decode(self, body):
+        '''
+            returns a json, or None if body is not valid
+        '''
+        try:
+            if self._codec.accepts_buffer:
+                return self._codec.loads(body)
+            return self._codec.loads(body.decode('utf-8'))
+        except ValueError:
+            logger.exception(f'Failed to parse {body}')
+            return None
+
+    def close(self):
+        pass
+
+
+class AsyncJsonRpcStreamWriter:
+    '''
+        write() may be called from any thread, the bytes are always handed
+        to the transport on the event loop.
+    '''
+    _HEADER = (b'Content-Length: %d\r\n'
+               b'Content-Type: application/vscode-jsonrpc; charset=utf8\r\n\r\n')
+
+    def __init__(self, writer: asyncio.StreamWriter, loop, codec=None):
+        self._writer = writer
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._codec = codec or get_codec()
+
+    def write(self, message):
+        frame = self.encode(message)
+        if frame is not None:
+            self.write_frame(frame)
+
+    def encode(self, message):
+        try:
+            body = self._codec.dumps_bytes(message)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Failed to encode message %s', message)
+            return None
+        return self._HEADER % len(body) + body
+
+    def write_frame(self, frame):
+        if threading.get_ident() == self._loop_thread:
+            self._send(frame)
+        else:
+            self._loop.call_soon_threadsafe(self._send, frame)
+
+    def _send(self, frame):
+        if not self._writer.is_closing():
+            self._writer.write(frame)
+
+    def close(self):
+        if threading.get_ident() == self._loop_thread:
+            self._writer.close()
+        else:
+            self._loop.call_soon_threadsafe(self._writer.close)
+
+
+class AsyncServerManager(ServerManager):
+    '''
+        transport is 'stdio', 'tcp' (host, port) or 'unix' (path).
+        reader and writer are ignored, the streams come from the transport.
+    '''
+    def __init__(self, masterServer, reader, writer, server_capability, max_workers=5,
+                 json_codec: Optional[str] = None, transport='stdio',
+                 host='127.0.0.1', port=2087, path: Optional[str] = None, telemetry=False,
+                 telemetry_interval: Optional[float] = None, **kwargs):
+        super().__init__(masterServer, None, None, server_capability,
+                         max_workers=max_workers, json_codec=json_codec, telemetry=telemetry,
+                         telemetry_interval=telemetry_interval)
+        self._codec = get_codec(json_codec)
+        self._transport = transport
+        self._host = host
+        self._port = port
+        self._path = path
+        self._max_workers = max_workers
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._editor_executor: Optional[ThreadPoolExecutor] = None
+        self._editor_queue: Optional[asyncio.Queue] = None
+        self._urgent = []
+        self._tasks = set()
+        self._limits = {}  # key -> [asyncio.Semaphore, tasks holding or waiting for it]
+        self._connections = set()
+
+    def start(self):
+        asyncio.run(self.serve())
+
+    def exit(self):
+        ''' called from a handler, stops serving once it returns '''
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._executor = ThreadPoolExecutor(self._max_workers, thread_name_prefix='normal')
+        self._editor_executor = ThreadPoolExecutor(1, thread_name_prefix='editor')
+        self._editor_queue = asyncio.Queue()
+        editor = asyncio.create_task(self._run_editor())
+        try:
+            if self._transport == 'stdio':
+                await self.serve_connection(*await self._stdio_streams())
+            else:
+                if self._transport == 'tcp':
+                    server = await asyncio.start_server(self.serve_connection,
+                                                        self._host, self._port)
+                elif self._transport == 'unix':
+                    server = await asyncio.start_unix_server(self.serve_connection,
+                                                             self._path)
+                else:
+                    raise ValueError(f'Unknown transport {self._transport}')
+                async with server:
+                    await self._stopping.wait()
+                    # let the connections see the stop before the loop ends
+                    await asyncio.gather(*self._connections, return_exceptions=True)
+        finally:
+            editor.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+            self._executor.shutdown(wait=False)
+            self._editor_executor.shutdown(wait=False)
+
+    async def _stdio_streams(self):
+        reader = asyncio.StreamReader()
+        await self._loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+        transport, protocol = await self._loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, sys.stdout.buffer)
+        writer = asyncio.StreamWriter(transport, protocol, reader, self._loop)
+        return reader, writer
+
+    async def serve_connection(self, reader: asyncio.StreamReader,
+                               writer: asyncio.StreamWriter):
+        '''
+            serve one client until it disconnects or sends exit
+        '''
+        self.jsonreader = AsyncJsonRpcStreamReader(reader, self._codec)
+        self.jsonwriter = AsyncJsonRpcStreamWriter(writer, self._loop, self._codec)
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        stop = asyncio.ensure_future(self._stopping.wait())
+        try:
+            while not self._stopping.is_set():
+                read = asyncio.ensure_future(self.jsonreader.read_frame())
+                await asyncio.wait({read, stop}, return_when=asyncio.FIRST_COMPLETED)
+                if not read.done():
+                    read.cancel()
+                    break
+                body = read.result()
+                if body is None:
+                    break
+                started = time.perf_counter()
+                message = self.jsonreader.decode(body)
+                if message is None:
+                    continue
+                if self.telemetry is not None:
+                    self._record_inbound(message, len(body), time.perf_counter() - started)
+                self._dispatch(message)
+                # urgent messages finish before the next one is read
+                while self._urgent:
+                    await self._urgent.pop(0)
+        finally:
+            stop.cancel()
+            self._connections.discard(connection)
+            self.jsonwriter.close()
+
+    def _schedule(self, worker_type, func, *args, **kwargs):
+        if not inspect.iscoroutinefunction(func):
+            func(*args, **kwargs)
+            return
+        coro = func(*args, worker_type=worker_type, **kwargs)
+        if worker_type == WorkerType.EDITOR:
+            self._editor_queue.put_nowait(coro)
+        elif worker_type == WorkerType.URGENT:
+            self._urgent.append(coro)
+        else:
+            task = self._loop.create_task(coro)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _schedule_keyed(self, worker_type, key, limit, priority, func, *args, **kwargs):
+        # EDITOR messages are already serialized by the editor task and the
+        # loop has no queue to order by priority
+        if (worker_type == WorkerType.NORMAL and key is not None and limit is not None
+                and inspect.iscoroutinefunction(func)):
+            func = functools.partial(self._limited, key, limit, func)
+        self._schedule(worker_type, func, *args, **kwargs)
+
+    async def _limited(self, key, limit, func, *args, **kwargs):
+        '''
+            await func(*args, **kwargs) with at most limit of the same key
+            running at once. Tasks start in the order they were created, so
+            they also acquire the semaphore in that order.
+        '''
+        entry = self._limits.get(key)
+        if entry is None:
+            entry = self._limits[key] = [asyncio.Semaphore(limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await func(*args, **kwargs)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._limits[key]
+
+    async def _timed(self, method, queued, handle, *args, **kwargs):
+        started = time.perf_counter()
+        self.telemetry.record_time(method, 'queue_wait', started - queued)
+        try:
+            return await handle(*args, **kwargs)
+        finally:
+            self.telemetry.record_time(method, 'handler', time.perf_counter() - started)
+
+    async def _run_editor(self):
+        while True:
+            coro = await self._editor_queue.get()
+            try:
+                await coro
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('editor task failed')
+
+    async def _call(self, handler, param, worker_type, token=None):
+        if token is not None and _accepts_token(handler):
+            handler = functools.partial(handler, token=token)
+        if _is_async(handler):
+            return await handler(param)
+        if worker_type == WorkerType.URGENT:
+            return handler(param)
+        executor = self._editor_executor if worker_type == WorkerType.EDITOR else self._executor
+        return await self._loop.run_in_executor(executor, handler, param)
+
+    async def _handle_request(self, msg_id, handler, param, record: ClientRequestRecord,
+                              worker_type=WorkerType.NORMAL, **kwargs):
+        if record.cancelled:
+            return
+        try:
+            result = await self._call(handler, param, worker_type, record)
+        except JsonRpcRequestCancelled:
+            return
+        except JsonRpcContentModified:
+            self.send_error_response(msg_id, ct.ErrorCodes.CONTENTMODIFIED)
+            return
+        except JsonRpcInvalidParams as error:
+            self.send_error_response(msg_id, ct.ErrorCodes.INVALIDPARAMS, str(error))
+            return
+        except Exception:  # pylint: disable=broad-except
+            logger.exception(f'{handler.__name__} failed')
+            self.send_error_response(msg_id, ct.ErrorCodes.INTERNALERROR)
+            return
+        if not record.cancelled:
+            self.send_response(msg_id, result)
+
+    async def _handle_notification(self, handler, param, worker_type=WorkerType.NORMAL,
+                                   **kwargs):
+        try:
+            await self._call(handler, param, worker_type)
+        except JsonRpcInvalidParams:
+            pass  # logged when decoding
+        except Exception:  # pylint: disable=broad-except
+            logger.exception(f'{handler.__name__} failed')
@@ -0,0 +1,4 @@
+'''
+    Micro-benchmarks, run them as modules from the directory containing the
+    package, e.g. python -m dpylsp.benchmarks.codec
+'''
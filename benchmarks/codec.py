@@ -0,0 +1,96 @@
+'''
+    Compare the installed JSON codecs on representative LSP payloads.
+
+    python -m dpylsp.benchmarks.codec [--number N]
+'''
+import argparse
+import timeit
+
+from ..codec import available_codecs
+
+
+def publish_diagnostics(count=5000):
+    return {
+        'jsonrpc': '2.0',
+        'method': 'textDocument/publishDiagnostics',
+        'params': {
+            'uri': 'file:///home/user/project/src/generated_module.py',
+            'diagnostics': [{
+                'range': {
+                    'start': {'line': i, 'character': 4},
+                    'end': {'line': i, 'character': 28},
+                },
+                'message': f'Undefined variable \'name_{i}\'',
+                'severity': 1 + i % 4,
+            } for i in range(count)],
+        },
+    }
+
+
+def did_open(lines=50000):
+    text = ''.join(f'    value_{i} = compute(value_{i - 1}, "数据 {i}")\n'
+                   for i in range(lines))
+    return {
+        'jsonrpc': '2.0',
+        'method': 'textDocument/didOpen',
+        'params': {
+            'textDocument': {
+                'uri': 'file:///home/user/project/src/big_module.py',
+                'languageId': 'python',
+                'version': 1,
+                'text': text,
+            },
+        },
+    }
+
+
+def did_change():
+    return {
+        'jsonrpc': '2.0',
+        'method': 'textDocument/didChange',
+        'params': {
+            'textDocument': {'uri': 'file:///home/user/project/a.py', 'version': 42},
+            'contentChanges': [{
+                'range': {
+                    'start': {'line': 120, 'character': 8},
+                    'end': {'line': 120, 'character': 8},
+                },
+                'text': 'x',
+            }],
+        },
+    }
+
+
+PAYLOADS = {
+    'publishDiagnostics(5000)': publish_diagnostics,
+    'didOpen(50k lines)': did_open,
+    'didChange': did_change,
+}
+
+
+def run(number: int):
+    codecs = available_codecs()
+    print(f'{"payload":<26}{"codec":<10}{"dumps_bytes":>14}{"loads":>14}')
+    for name, factory in PAYLOADS.items():
+        message = factory()
+        body = codecs[-1].dumps_bytes(message)
+        count = max(1, number * 1000 // max(len(body) // 1000, 1))
+        for codec in codecs:
+            if codec.accepts_buffer:
+                view = memoryview(body)
+                load_body = lambda: codec.loads(view)
+            else:
+                # the streams decode the body first for these backends
+                load_body = lambda: codec.loads(str(body, 'utf-8'))
+            dump = min(timeit.repeat(lambda: codec.dumps_bytes(message),
+                                     number=count, repeat=3)) / count
+            load = min(timeit.repeat(load_body, number=count, repeat=3)) / count
+            print(f'{name:<26}{codec.name:<10}{dump * 1e6:>11.1f} us'
+                  f'{load * 1e6:>11.1f} us')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=1,
+                        help='scale the number of iterations')
+    run(parser.parse_args().number)
@@ -0,0 +1,63 @@
+'''
+    Bytes per Diagnostic (with its Range and Positions) for the slotted
+    struct classes against dict-backed copies of them, the layout they had
+    before.
+
+    python -m dpylsp.benchmarks.memory [--count N]
+'''
+import argparse
+import gc
+import tracemalloc
+
+from ..dpylsp import LspItem
+from ..struct import Diagnostic, Position, Range
+
+
+class DictPosition(LspItem):
+    def __init__(self, line, character, **kwargs):
+        self.line = line
+        self.character = character
+
+
+class DictRange(LspItem):
+    def __init__(self, start, end, **kwargs):
+        self.start = start
+        self.end = end
+
+
+class DictDiagnostic(LspItem):
+    def __init__(self, range, message, severity=None, **kwargs):
+        self.range = range
+        self.message = message
+        self.severity = severity
+
+
+def diagnostics(count, position=Position, range_=Range, diagnostic=Diagnostic):
+    # the message is shared, only the structures are measured
+    return [diagnostic(range_(position(i, 4), position(i, 28)), 'Undefined variable', 1)
+            for i in range(count)]
+
+
+def measure(count, **classes) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = diagnostics(count, **classes)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del items
+    return size / count
+
+
+def run(count: int):
+    before = measure(count, position=DictPosition, range_=DictRange, diagnostic=DictDiagnostic)
+    after = measure(count)
+    print(f'{"Diagnostic x " + str(count):<24}{"dict":>12}{"slots":>12}{"saved":>10}')
+    print(f'{"bytes per item":<24}{before:>12.0f}{after:>12.0f}{1 - after / before:>10.0%}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=20000,
+                        help='number of diagnostics to allocate')
+    run(parser.parse_args().count)
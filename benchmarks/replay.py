@@ -0,0 +1,268 @@
+'''
+    Replay JSON-RPC sessions through LanguageServer over in-process pipes
+    and report throughput, latency per method and peak RSS.
+
+    A session is a JSONL file holding one client message per line. The
+    synthetic ones are generated:
+
+    python -m dpylsp.benchmarks.replay [SESSION.jsonl ...]
+           [--synthetic typing|open|multiroot ...] [--record DIR]
+           [--set pipelined=True --set json_codec="'json'" ...]
+
+    --set passes a keyword argument (a python literal) to LanguageServer,
+    to compare the options of ServerManager. Round-trip times are measured
+    by the client for requests, queue wait and handler times come from the
+    server's telemetry.
+'''
+import argparse
+import ast
+import itertools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List
+
+from ..languageserver import LanguageServer
+from ..telemetry import Histogram
+
+_END_ID = 'replay-end'
+
+
+def _initialize(root_uri, folders=None):
+    params = {'processId': os.getpid(), 'rootUri': root_uri, 'capabilities': {}}
+    if folders:
+        params['workspaceFolders'] = [{'uri': uri, 'name': uri.rsplit('/', 1)[-1]}
+                                      for uri in folders]
+    return [
+        {'jsonrpc': '2.0', 'id': 'initialize', 'method': 'initialize', 'params': params},
+        {'jsonrpc': '2.0', 'method': 'initialized', 'params': {}},
+    ]
+
+
+def _did_open(uri, text, version=1):
+    return {'jsonrpc': '2.0', 'method': 'textDocument/didOpen',
+            'params': {'textDocument': {'uri': uri, 'languageId': 'python',
+                                        'version': version, 'text': text}}}
+
+
+def _source(lines, seed=0):
+    return ''.join(f'def function_{seed}_{i}(value):\n    return value * {i}\n'
+                   for i in range(lines // 2))
+
+
+def typing_storm(keystrokes=20000, documents=4, lines=2000) -> Iterable[dict]:
+    '''
+        incremental didChange notifications as fast as a user could never
+        type, round robin over a few open documents
+    '''
+    yield from _initialize('file:///replay/project')
+    uris = [f'file:///replay/project/module_{i}.py' for i in range(documents)]
+    for i, uri in enumerate(uris):
+        yield _did_open(uri, _source(lines, i))
+    for stroke in range(keystrokes):
+        document = stroke % documents
+        line = (stroke // documents) % lines
+        yield {'jsonrpc': '2.0', 'method': 'textDocument/didChange',
+               'params': {'textDocument': {'uri': uris[document], 'version': stroke + 2},
+                          'contentChanges': [{
+                              'range': {'start': {'line': line, 'character': 4},
+                                        'end': {'line': line, 'character': 4}},
+                              'text': 'x'}]}}
+
+
+def open_burst(files=500, lines=5000) -> Iterable[dict]:
+    '''
+        a client opening many large documents at once, as after restoring
+        a session
+    '''
+    yield from _initialize('file:///replay/project')
+    text = _source(lines)
+    for i in range(files):
+        yield _did_open(f'file:///replay/project/package/module_{i}.py', text)
+    for i in range(files):
+        yield {'jsonrpc': '2.0', 'method': 'textDocument/didClose',
+               'params': {'textDocument': {'uri': f'file:///replay/project/package/module_{i}.py'}}}
+
+
+def multi_root(roots=8, files=50, lines=500) -> Iterable[dict]:
+    '''
+        a workspace of several folders, changed while documents of every
+        folder are open and edited
+    '''
+    folders = [f'file:///replay/root_{i}' for i in range(roots)]
+    yield from _initialize(folders[0], folders)
+    for folder, i in itertools.product(folders, range(files)):
+        yield _did_open(f'{folder}/module_{i}.py', _source(lines, i))
+    for i, folder in enumerate(folders):
+        added = f'file:///replay/extra_{i}'
+        yield {'jsonrpc': '2.0', 'method': 'workspace/didChangeWorkspaceFolders',
+               'params': {'event': {'added': [{'uri': added, 'name': f'extra_{i}'}],
+                                    'removed': [{'uri': folder, 'name': f'root_{i}'}]}}}
+        for j in range(files):
+            yield {'jsonrpc': '2.0', 'method': 'textDocument/didChange',
+                   'params': {'textDocument': {'uri': f'{folder}/module_{j}.py', 'version': 2},
+                              'contentChanges': [{
+                                  'range': {'start': {'line': 0, 'character': 0},
+                                            'end': {'line': 0, 'character': 0}},
+                                  'text': '# edited\n'}]}}
+
+
+SYNTHETIC = {
+    'typing': typing_storm,
+    'open': open_burst,
+    'multiroot': multi_root,
+}
+
+
+def load_session(path) -> List[dict]:
+    with open(path, encoding='utf-8') as session:
+        return [json.loads(line) for line in session if line.strip()]
+
+
+def save_session(path, messages: Iterable[dict]):
+    with open(path, 'w', encoding='utf-8') as session:
+        for message in messages:
+            session.write(json.dumps(message) + '\n')
+
+
+class _Client:
+    '''
+        writes the session to the server and reads everything it answers
+    '''
+    def __init__(self, wfile, rfile):
+        self._wfile = wfile
+        self._rfile = rfile
+        self._lock = threading.Lock()
+        self.sent = {}  # request id -> (method, time sent)
+        self.round_trip: Dict[str, Histogram] = {}
+        self.done = threading.Event()
+        self._reader = threading.Thread(target=self._read, name='replay-client', daemon=True)
+        self._reader.start()
+
+    def close(self):
+        ''' hang up, the server reads the end of its input '''
+        with self._lock:
+            self._wfile.close()
+
+    def send(self, message):
+        body = json.dumps(message).encode('utf-8')
+        if 'id' in message and 'method' in message:
+            self.sent[message['id']] = (message['method'], time.perf_counter())
+        with self._lock:
+            self._wfile.write(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+            self._wfile.flush()
+
+    def _read(self):
+        while True:
+            header = self._rfile.readline()
+            if not header:
+                return
+            length = int(header.split(b':')[1])
+            while self._rfile.readline().strip():
+                pass
+            message = json.loads(self._rfile.read(length))
+            if 'method' in message:
+                if 'id' in message:
+                    # no settings for workspace/configuration, nothing for the rest
+                    items = (message.get('params') or {}).get('items')
+                    result = [None] * len(items) if isinstance(items, list) else None
+                    self.send({'jsonrpc': '2.0', 'id': message['id'], 'result': result})
+                continue
+            sent = self.sent.pop(message.get('id'), None)
+            if sent is not None:
+                method, started = sent
+                self.round_trip.setdefault(method, Histogram()).record(
+                    (time.perf_counter() - started) * 1e6)
+            if message.get('id') == _END_ID:
+                self.done.set()
+
+
+def replay(messages: Iterable[dict], **server_options) -> dict:
+    '''
+        run one session, returns its measurements
+    '''
+    messages = list(messages)
+    client_read, server_write = os.pipe()
+    server_read, client_write = os.pipe()
+    server_options.setdefault('telemetry', True)
+    server = LanguageServer(os.fdopen(server_read, 'rb'), os.fdopen(server_write, 'wb'),
+                            **server_options)
+    serving = threading.Thread(target=server.start, name='replay-server', daemon=True)
+    serving.start()
+    client = _Client(os.fdopen(client_write, 'wb'), os.fdopen(client_read, 'rb'))
+
+    started = time.perf_counter()
+    for message in messages:
+        client.send(message)
+    # answered once everything before it has been dispatched
+    client.send({'jsonrpc': '2.0', 'id': _END_ID, 'method': '$/dpylsp/stats'})
+    client.done.wait()
+    server.manager.editor.q.join()
+    server.manager.normal.q.join()
+    elapsed = time.perf_counter() - started
+
+    methods = server.manager.stats()['methods'] or {}
+    client.send({'jsonrpc': '2.0', 'method': 'exit'})
+    client.close()
+    serving.join()
+    return {
+        'messages': len(messages),
+        'elapsed': elapsed,
+        'throughput': len(messages) / elapsed,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'round_trip': {method: histogram.getDict()
+                       for method, histogram in client.round_trip.items()},
+        'methods': methods,
+    }
+
+
+def report(name: str, result: dict):
+    print(f"{name}: {result['messages']} messages in {result['elapsed']:.2f}s, "
+          f"{result['throughput']:.0f} msg/s, peak RSS {result['peak_rss'] / 2 ** 20:.1f} MB")
+    print(f'  {"method":<38}{"count":>7}{"rtt p50":>10}{"rtt p99":>10}'
+          f'{"wait p50":>10}{"wait p99":>10}{"run p50":>10}{"run p99":>10}  (us)')
+    for method in sorted(set(result['methods']) | set(result['round_trip'])):
+        if method == '$/dpylsp/stats':
+            continue
+        metrics = result['methods'].get(method, {})
+        rtt = result['round_trip'].get(method, {})
+        wait = metrics.get('queue_wait', {})
+        run = metrics.get('handler', {})
+        count = run.get('count') or rtt.get('count') or metrics.get('bytes_in', {}).get('count', 0)
+        cells = [rtt.get('p50'), rtt.get('p99'), wait.get('p50'), wait.get('p99'),
+                 run.get('p50'), run.get('p99')]
+        print(f'  {method:<38}{count:>7}' + ''.join(
+            f'{"-" if cell is None else cell:>10}' for cell in cells))
+
+
+def _option(text):
+    key, _, value = text.partition('=')
+    return key, ast.literal_eval(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sessions', nargs='*', help='JSONL files of client messages')
+    parser.add_argument('--synthetic', action='append', choices=sorted(SYNTHETIC),
+                        help='generate a session, may be repeated')
+    parser.add_argument('--record', metavar='DIR',
+                        help='also save the synthetic sessions as JSONL in DIR')
+    parser.add_argument('--set', action='append', type=_option, default=[],
+                        metavar='KEY=VALUE', help='LanguageServer keyword argument')
+    args = parser.parse_args()
+    if not args.sessions and not args.synthetic:
+        args.synthetic = sorted(SYNTHETIC)
+    options = dict(args.set)
+    sessions = [(path, load_session(path)) for path in args.sessions]
+    for name in args.synthetic or []:
+        messages = list(SYNTHETIC[name]())
+        if args.record:
+            save_session(os.path.join(args.record, f'{name}.jsonl'), messages)
+        sessions.append((name, messages))
+    for name, messages in sessions:
+        report(name, replay(messages, **options))
+    sys.stdout.flush()
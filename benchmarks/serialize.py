@@ -0,0 +1,101 @@
+'''
+    Compare the compiled LspItem.getDict on the slotted struct classes with
+    the generic vars() walk over dict-backed copies of them, what it replaced.
+
+    python -m dpylsp.benchmarks.serialize [--number N]
+'''
+import argparse
+import timeit
+
+from ..dpylsp import LspItem
+from ..param import PublishDiagnosticParams
+from ..struct import (Diagnostic, Position, Range, TextDocumentEdit, TextEdit,
+                      VersionedTextDocumentIdentifier)
+from .memory import DictDiagnostic, DictPosition, DictRange
+
+
+def generic_convert(target):
+    if target is None:
+        return None
+    if isinstance(target, int):
+        return int(target)
+    if isinstance(target, (float, str)):
+        return target
+    elif isinstance(target, list):
+        return [generic_convert(item) for item in target]
+    elif isinstance(target, dict):
+        return {key: generic_convert(value) for key, value in target.items()}
+    elif isinstance(target, LspItem):
+        return generic_getDict(target)
+    return None
+
+
+def generic_getDict(item):
+    if type(item).getDict is not LspItem.getDict:
+        return item.getDict()
+    dump_dict = {}
+    for key, value in vars(item).items():
+        if value is not None:
+            converted = generic_convert(value)
+            if converted is not None:
+                dump_dict[key] = converted
+    return dump_dict
+
+
+class DictTextEdit(LspItem):
+    def __init__(self, range, newText, **kwargs):
+        self.range = range
+        self.newText = newText
+
+
+class DictVersionedTextDocumentIdentifier(LspItem):
+    def __init__(self, uri, version=None, **kwargs):
+        self.uri = uri
+        self.version = version
+
+
+def diagnostics(count=5000, legacy=False):
+    position, range_, diagnostic = ((DictPosition, DictRange, DictDiagnostic) if legacy
+                                    else (Position, Range, Diagnostic))
+    return PublishDiagnosticParams(
+        'file:///home/user/project/src/generated_module.py',
+        [diagnostic(range_(position(i, 4), position(i, 28)),
+                    f'Undefined variable \'name_{i}\'', 1 + i % 4)
+         for i in range(count)])
+
+
+def text_document_edit(count=5000, legacy=False):
+    position, range_, text_edit, identifier = (
+        (DictPosition, DictRange, DictTextEdit, DictVersionedTextDocumentIdentifier) if legacy
+        else (Position, Range, TextEdit, VersionedTextDocumentIdentifier))
+    return TextDocumentEdit(
+        identifier('file:///home/user/project/a.py', 7),
+        [text_edit(range_(position(i, 0), position(i, 12)), f'renamed_{i}')
+         for i in range(count)])
+
+
+PAYLOADS = {
+    'PublishDiagnosticParams(5000)': diagnostics,
+    'TextDocumentEdit(5000)': text_document_edit,
+}
+
+
+def _best(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def run(number: int):
+    print(f'{"getDict":<32}{"generic":>12}{"compiled":>12}{"speedup":>10}')
+    for name, factory in PAYLOADS.items():
+        item, legacy = factory(), factory(legacy=True)
+        assert item.getDict() == generic_getDict(legacy)
+        before = _best(lambda: generic_getDict(legacy), number * 5)
+        after = _best(item.getDict, number * 5)
+        print(f'{name:<32}{before * 1e3:>9.2f} ms{after * 1e3:>9.2f} ms{before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=1,
+                        help='scale the number of iterations')
+    run(parser.parse_args().number)
@@ -0,0 +1,146 @@
+'''
+    JSON backends for the JSON-RPC streams.
+
+    The backend is chosen at runtime: by name through get_codec(), the
+    DPYLSP_JSON_CODEC environment variable, or else the fastest one installed.
+'''
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CODEC_ENV = 'DPYLSP_JSON_CODEC'
+
+
+class JsonCodec:
+    '''
+        binary: dumps() already returns utf-8 bytes
+        accepts_buffer: loads() takes a memoryview without copying it
+    '''
+    name = ''
+    binary = False
+    accepts_buffer = False
+
+    def loads(self, data):
+        ''' backends replace this with the decoding function itself '''
+        raise NotImplementedError
+
+    def dumps(self, obj, **kwargs):
+        raise NotImplementedError
+
+    def dumps_bytes(self, obj, **kwargs) -> bytes:
+        body = self.dumps(obj, **kwargs)
+        return body if self.binary else body.encode('utf-8')
+
+
+class StdlibCodec(JsonCodec):
+    name = 'json'
+
+    def __init__(self):
+        self.loads = json.loads
+
+    def dumps(self, obj, **kwargs):
+        return json.dumps(obj, **kwargs)
+
+
+class UjsonCodec(JsonCodec):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+        self.loads = ujson.loads
+
+    def dumps(self, obj, **kwargs):
+        return self._ujson.dumps(obj, **kwargs)
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+    binary = True
+    accepts_buffer = True
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self.loads = orjson.loads
+        # int keys are turned into strings, as json.dumps does
+        self._option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        option = self._option
+        for name, value in kwargs.items():
+            if name == 'sort_keys':
+                if value:
+                    option |= self._orjson.OPT_SORT_KEYS
+            elif name == 'indent' and value in (None, 2):
+                if value:
+                    option |= self._orjson.OPT_INDENT_2
+            else:
+                # no orjson option for the rest of json.dumps' keyword arguments
+                return json.dumps(obj, **kwargs).encode('utf-8')
+        return self._orjson.dumps(obj, option=option)
+
+
+class MsgspecCodec(JsonCodec):
+    name = 'msgspec'
+    binary = True
+    accepts_buffer = True
+
+    def __init__(self):
+        import msgspec
+        self._encoder = msgspec.json.Encoder()
+        self._decode = msgspec.json.Decoder().decode
+        self._error = msgspec.DecodeError
+
+    def loads(self, data):
+        try:
+            return self._decode(data)
+        except self._error as error:
+            # the streams only expect ValueError from a bad body
+            raise ValueError(str(error)) from error
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # msgspec has no equivalent of json.dumps' keyword arguments
+            return json.dumps(obj, **kwargs).encode('utf-8')
+        return self._encoder.encode(obj)
+
+
+# fastest first
+_CODECS = [OrjsonCodec, MsgspecCodec, UjsonCodec, StdlibCodec]
+_CODEC_BY_NAME = {codec.name: codec for codec in _CODECS}
+_instances: Dict[str, JsonCodec] = {}
+
+
+def _load(name: str) -> Optional[JsonCodec]:
+    if name not in _instances:
+        try:
+            _instances[name] = _CODEC_BY_NAME[name]()
+        except ImportError:
+            return None
+    return _instances[name]
+
+
+def available_codecs() -> List[JsonCodec]:
+    codecs = [_load(codec.name) for codec in _CODECS]
+    return [codec for codec in codecs if codec is not None]
+
+
+def get_codec(name: Optional[str] = None) -> JsonCodec:
+    '''
+        name is one of orjson, msgspec, ujson and json. An unknown or
+        missing backend falls back to the fastest installed one.
+    '''
+    name = name or os.environ.get(CODEC_ENV)
+    if name:
+        if name not in _CODEC_BY_NAME:
+            logger.warning('Unknown json codec %s', name)
+        else:
+            codec = _load(name)
+            if codec is not None:
+                return codec
+            logger.warning('json codec %s is not installed', name)
+    return available_codecs()[0]
@@ -1,5 +1,5 @@
 from typing import List
-from enum import IntEnum
+from enum import Enum, IntEnum
 
 JSONRPC_VERSION = '2.0'
 
@@ -9,6 +9,15 @@ class TextDocumentSyncKind(IntEnum):
     INCREMENTAL = 2
 
 
+class PositionEncodingKind(str, Enum):
+    '''
+        How Position.character is counted. UTF16 is the protocol default.
+    '''
+    UTF8 = 'utf-8'
+    UTF16 = 'utf-16'
+    UTF32 = 'utf-32'
+
+
 class DiagnosticSeverity(IntEnum):
     ERROR = 1
     WARNING = 2
@@ -0,0 +1,152 @@
+'''
+    Diagnostics computed in the background after edits.
+
+    A server linting on every didChange would compute diagnostics for
+    versions the user has already typed past. DiagnosticsScheduler waits
+    until a document has been quiet for `delay` seconds, cancels a
+    computation made obsolete by a newer version and publishes only the
+    latest result, unless it equals what the client already shows.
+'''
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from .dpylsp import _convert_val
+from .exception import JsonRpcRequestCancelled
+from .manager import ClientRequestRecord
+from .param import PublishDiagnosticParams
+from .struct import DocumentUri
+from .uri import NormalizedUri, normalizeUri
+from . import worker
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(diagnostics) -> bytes:
+    dumped = json.dumps(_convert_val(list(diagnostics)), sort_keys=True)
+    return hashlib.blake2b(dumped.encode('utf-8'), digest_size=16).digest()
+
+
+class DiagnosticsScheduler:
+    '''
+        publish: called with the PublishDiagnosticParams to send, usually
+                 ServerManager.send_diagnostics
+        workers: threads computing diagnostics, one document at a time each
+    '''
+    def __init__(self, publish: Callable[[PublishDiagnosticParams], None],
+                 delay=0.3, workers=1):
+        self._publish = publish
+        self._delay = delay
+        self._worker = worker.Worker(name='diagnostics', count=workers)
+        self._cond = threading.Condition()
+        # keyed by normalizeUri, a client may spell one document's uri two ways
+        self._pending = {}  # key -> (due, uri, version, compute)
+        self._running: Dict[NormalizedUri, ClientRequestRecord] = {}
+        self._published: Dict[NormalizedUri, bytes] = {}  # key -> digest
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.stats = {'computed': 0, 'published': 0, 'unchanged': 0, 'superseded': 0}
+
+    def schedule(self, uri: DocumentUri, compute, version: Optional[int] = None):
+        '''
+            compute(token) returns the diagnostics of uri, it may be a
+            coroutine function. It runs once uri has not been scheduled
+            again for `delay` seconds. Scheduling uri again cancels the token
+            of a computation still running, whose result is then dropped.
+        '''
+        key = normalizeUri(uri)
+        with self._cond:
+            if self._closed:
+                return
+            running = self._running.get(key)
+            if running is not None:
+                running.cancel()
+            if key in self._pending:
+                self.stats['superseded'] += 1
+            self._pending[key] = (time.monotonic() + self._delay, uri, version, compute)
+            if self._thread is None:
+                self._worker.start()
+                self._thread = threading.Thread(target=self._dispatch, name='diagnostics-timer',
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def forget(self, uri: DocumentUri):
+        '''
+            drop the pending work and the last published set of uri, call it
+            when the document is closed
+        '''
+        key = normalizeUri(uri)
+        with self._cond:
+            self._pending.pop(key, None)
+            running = self._running.pop(key, None)
+            if running is not None:
+                running.cancel()
+            self._published.pop(key, None)
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending.clear()
+            for running in self._running.values():
+                running.cancel()
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._worker.close()
+
+    def _dispatch(self):
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                due = [key for key, (deadline, *_) in self._pending.items() if deadline <= now]
+                for key in due:
+                    _, uri, version, compute = self._pending.pop(key)
+                    token = ClientRequestRecord()
+                    self._running[key] = token
+                    # a superseded computation of uri finishes first
+                    self._worker.assign_keyed(key, 1, self._run, key, uri, version, compute,
+                                              token)
+                deadlines = [deadline for deadline, *_ in self._pending.values()]
+                self._cond.wait(min(deadlines) - now if deadlines else None)
+
+    def _run(self, key, uri, version, compute, token: ClientRequestRecord):
+        if token.cancelled:
+            self._count('superseded')
+            return
+        try:
+            diagnostics = compute(token)
+            if inspect.iscoroutine(diagnostics):
+                diagnostics = asyncio.run(diagnostics)
+        except JsonRpcRequestCancelled:
+            self._count('superseded')
+            return
+        except Exception:
+            logger.exception(f'diagnostics of {uri} failed')
+            return
+        diagnostics = list(diagnostics or [])
+        digest = _digest(diagnostics)
+        with self._cond:
+            self.stats['computed'] += 1
+            if token.cancelled or self._running.get(key) is not token:
+                self.stats['superseded'] += 1
+                return
+            del self._running[key]
+            if self._published.get(key) == digest:
+                self.stats['unchanged'] += 1
+                return
+            self._published[key] = digest
+            self.stats['published'] += 1
+        # the key of uri is held until this returns, publications stay ordered
+        self._publish(PublishDiagnosticParams(uri, diagnostics, version))
+
+    def _count(self, name):
+        with self._cond:
+            self.stats[name] += 1
@@ -1,32 +1,105 @@
 import logging
+from types import MappingProxyType
+from typing import Optional
+
+from .exception import JsonRpcInvalidParams
 
 logger = logging.getLogger(__name__)
 
 
 def _convert_val(target):
+    kind = type(target)
+    if kind is str or kind is float or kind is int:
+        return target
+    compiled = _dumpers.get(kind)
+    if compiled is not None:
+        if compiled[0] is None or target.__dict__.keys() <= compiled[0]:
+            return compiled[1](target)
+        return target.getDict()
+    if kind is list:
+        return [_convert_val(item) for item in target]
     if target is None:
         return None
     if isinstance(target, int):
         return int(target)  # note that we use int() to get value from a IntEnum
     if isinstance(target, (float, str)):
         return target
-    elif isinstance(target, list):
-        result = []
-        for item in target:
-            result.append(_convert_val(item))
-        return result
-    elif isinstance(target, dict):
+    elif isinstance(target, (list, tuple)):
+        return [_convert_val(item) for item in target]
+    elif isinstance(target, (dict, MappingProxyType)):
         result = {}
         for key, value in target.items():
             result[key] = _convert_val(value)
         return result
-    elif isinstance(target, LspItem):
+    elif isinstance(target, SlottedLspItem):
         return target.getDict()
     else:
         return None
 
 
-class LspItem(object):
+'''
+    getDict is compiled once per class into a straight-line function over the
+    slots of the class and the attributes seen so far, instead of looping
+    over vars() on every call. An instance with an attribute the function
+    does not know recompiles it. Classes overriding getDict are never
+    compiled.
+'''
+_dumpers = {}  # class -> (attribute names or None when slotted, function(item) -> dict)
+_MISSING = object()
+
+
+def _slots(cls) -> tuple:
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        names.extend([slots] if isinstance(slots, str) else slots)
+    return tuple(name for name in names if name not in ('__dict__', '__weakref__'))
+
+
+def _fields(item):
+    fields = {name: getattr(item, name, _MISSING) for name in _slots(type(item))}
+    if hasattr(item, '__dict__'):
+        fields.update(vars(item))
+    return fields
+
+
+def _compile_dumper(slots, names):
+    lines = ['def dump(item):', '    out = {}']
+    if names:
+        lines.append('    d = item.__dict__')
+    for name in slots + tuple(names):
+        if name in slots:
+            lines.append(f'    value = getattr(item, {name!r}, None)')
+        else:
+            lines.append(f'    value = d.get({name!r})')
+        lines += [
+            '    kind = type(value)',
+            '    if kind is str or kind is int or kind is float:',
+            f'        out[{name!r}] = value',
+            '    elif value is not None:',
+            '        compiled = dumpers.get(kind)',
+            '        if compiled is not None and (compiled[0] is None',
+            '                                     or value.__dict__.keys() <= compiled[0]):',
+            f'            out[{name!r}] = compiled[1](value)',
+            '        else:',
+            '            value = convert(value)',
+            '            if value is not None:',
+            f'                out[{name!r}] = value',
+        ]
+    lines.append('    return out')
+    namespace = {'convert': _convert_val, 'dumpers': _dumpers}
+    exec('\n'.join(lines), namespace)
+    return namespace['dump']
+
+
+class SlottedLspItem(object):
+    '''
+        The base of LspItem without an instance dict. Subclasses declaring
+        __slots__ have none either, isinstance() checks should use this
+        class to accept both kinds.
+    '''
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         for key, value in kwargs.items():
             setattr(self, key, value)
@@ -42,46 +115,178 @@ class LspItem(object):
         return str(self.getDict())
 
     def getDict(self):
-        dump_dict = {}
-        for key, value in vars(self).items():
-            if value is not None:
-                converted = _convert_val(value)
-                if converted is not None:
-                    dump_dict[key] = converted
-        return dump_dict
+        kind = type(self)
+        compiled = _dumpers.get(kind)
+        if compiled is None or (compiled[0] is not None
+                                and not vars(self).keys() <= compiled[0]):
+            if kind.getDict is not SlottedLspItem.getDict:
+                # called through super(), _convert_val must keep calling the override
+                return {key: converted for key, converted in
+                        ((key, _convert_val(value)) for key, value in _fields(self).items()
+                         if value is not _MISSING)
+                        if converted is not None}
+            slots = _slots(kind)
+            if hasattr(self, '__dict__'):
+                # None values are skipped, so a missing attribute is harmless
+                names = dict.fromkeys(compiled[0] if compiled else ())
+                names.update(dict.fromkeys(vars(self)))
+                names = names.keys()
+            else:
+                names = None
+            compiled = _dumpers[kind] = (names, _compile_dumper(slots, names or ()))
+        return compiled[1](self)
+
+
+class LspItem(SlottedLspItem):
+    '''
+        Attributes in an instance dict, any keyword is accepted.
+    '''
+
+
+def _freeze(value):
+    ''' a read-only view of a decoded JSON value '''
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    '''
+        value with the views of _freeze turned back into dicts and lists,
+        value itself if it holds none
+    '''
+    if isinstance(value, (dict, MappingProxyType)):
+        thawed = {key: _thaw(item) for key, item in value.items()}
+        if type(value) is dict and all(thawed[key] is item for key, item in value.items()):
+            return value
+        return thawed
+    if isinstance(value, (list, tuple)):
+        thawed = [_thaw(item) for item in value]
+        if type(value) is list and all(new is old for new, old in zip(thawed, value)):
+            return value
+        return thawed
+    return value
+
+
+def _copy(value):
+    ''' a deep copy of a JSON value made of plain dicts and lists '''
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _flatten(tree: dict) -> dict:
+    '''
+        every dotted path into the nested dicts of tree -> read-only value
+    '''
+    index = {}
+    pending = [('', tree)]
+    while pending:
+        prefix, node = pending.pop()
+        for key, value in node.items():
+            path = prefix + key
+            index[path] = _freeze(value)
+            if isinstance(value, dict):
+                pending.append((path + '.', value))
+    return index
+
 
 class DictLspItem(LspItem):
     '''
-        A LspItem that actually is an dict
+        A LspItem that actually is an dict. Every dotted path into it is
+        indexed when it is built or updated, so looking one up is a single
+        dict access; values come back as read-only views (mappingproxy,
+        tuple). Views passed back in are stored as plain dicts and lists, so
+        getDict() stays JSON.
     '''
     def __init__(self, **kwargs):
-        self._dict = kwargs
+        self._dict = _thaw(kwargs)
+        self._index = _flatten(self._dict)
 
     def update(self, new_dict: dict):
-        self._dict.update(new_dict)
-    
+        self._dict.update(_thaw(new_dict))
+        self._index = _flatten(self._dict)
+
+    def merged(self, new_dict: dict):
+        '''
+            a new item with new_dict's top level keys replacing ours, this
+            one is left as it is for whoever holds it
+        '''
+        return type(self)(**{**self._dict, **new_dict})
+
     @classmethod
     def fromDict(cls, param: dict):
         return cls(**param)
 
     def getDict(self):
-        return self._dict
+        '''
+            a copy, the item is shared by whoever got it from the manager and
+            its index must stay in step with its dict
+        '''
+        return _copy(self._dict)
     
     def hasAttr(self, item: Optional[str]) -> bool:
         if item is None:
             return True
-        return bool(self.__get__(item))
+        return bool(self._index.get(item))
 
     def __get__(self, var_name):
-        attr_list = var_name.split('.')
-        cur_var = self._dict
-        try:
-            for attr in attr_list:
-                cur_var = cur_var[attr]
-            return cur_var
-        except KeyError:
-            return None
+        return self._index.get(var_name)
     
-    def __contain__(self, item: str) -> bool:
+    def __contains__(self, item: str) -> bool:
         return self.hasAttr(item)
-    
\ No newline at end of file
+
+    __contain__ = __contains__
+    
+
+_UNDECODED = object()
+
+
+class LazyParams(object):
+    '''
+        Stands for param_type.fromDict(raw) and decodes it on first attribute
+        access, on the thread running the handler. A handler that never looks
+        at its param never pays for decoding it. isinstance() sees param_type.
+    '''
+    __slots__ = ('_param_type', '_raw', '_value')
+
+    def __init__(self, param_type, raw):
+        self._param_type = param_type
+        self._raw = raw
+        self._value = _UNDECODED
+
+    @property
+    def __class__(self):
+        return self._param_type
+
+    def resolve(self):
+        '''
+            the decoded param, raises JsonRpcInvalidParams if it cannot be
+        '''
+        value = self._value
+        if value is _UNDECODED:
+            try:
+                value = self._param_type.fromDict(self._raw)
+            except (KeyError, TypeError, ValueError, AttributeError) as error:
+                logger.error('Parameter parse error: %s %s', self._param_type.__name__,
+                             str(self._raw))
+                raise JsonRpcInvalidParams(str(error)) from error
+            self._value = value
+            self._raw = None
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def getDict(self):
+        return self.resolve().getDict()
+
+    def __repr__(self):
+        return repr(self.resolve())
+
+    def __str__(self):
+        return str(self.resolve())
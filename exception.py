@@ -2,6 +2,20 @@ class JsonRpcRequestCancelled(Exception):
     pass
 
 
+class JsonRpcContentModified(Exception):
+    '''
+        raised by a handler whose result is based on an outdated document
+    '''
+    pass
+
+
+class JsonRpcInvalidParams(Exception):
+    '''
+        raised when the params of a message cannot be decoded
+    '''
+    pass
+
+
 class JsonRpcException(Exception):
     @staticmethod
     def fromDict(error):
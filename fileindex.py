@@ -0,0 +1,405 @@
+'''
+    The files of the workspace folders, without walking the disk for every
+    question.
+
+    Each folder added is scanned once, on a pool of threads, and kept up to
+    date by workspace/didChangeWatchedFiles events; events arriving during
+    the scan are applied after it. A file belongs to the innermost folder
+    only, folders nested in another are left out of its index. Files are
+    filtered with globs in the syntax of FileSystemWatcher.globPattern,
+    matched against the path relative to the folder with '/' separators.
+    Lookups by name, extension and path prefix return file system paths,
+    uri.fsPathsToUris converts them in bulk. The disk is only read outside
+    the lock, lookups never wait for a walk.
+'''
+import bisect
+import functools
+import logging
+import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .constant import FileChangeType
+from .struct import FileEvent, WorkspaceFolder
+from .uri import NormalizedUri, normalizeUri, uriTofsPath, urisTofsPaths
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXCLUDE = ('**/.git', '**/.hg', '**/.svn', '**/__pycache__', '**/node_modules')
+
+
+@functools.lru_cache(maxsize=256)
+def compileGlob(pattern: str, subtree: bool = False) -> 're.Pattern[str]':
+    '''
+        a regex for a FileSystemWatcher glob pattern: *, ?, **, {a,b},
+        [...] and [!...]. With subtree it also matches everything below a
+        matching directory.
+    '''
+    out = []
+    braces = 0
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = end + 1
+                continue
+        elif c == '{':
+            braces += 1
+            out.append('(?:')
+        elif c == ',' and braces:
+            out.append('|')
+        elif c == '}' and braces:
+            braces -= 1
+            out.append(')')
+        else:
+            out.append(re.escape(c))
+        i += 1
+    out.append(')' * braces)
+    if subtree:
+        out.append('(?:/.*)?')
+    return re.compile(''.join(out) + r'\Z', re.S)
+
+
+class GlobFilter:
+    '''
+        a relative path passes if it matches one of include and neither it
+        nor one of its directories matches one of exclude
+    '''
+    def __init__(self, include: Iterable[str] = ('**/*',), exclude: Iterable[str] = DEFAULT_EXCLUDE):
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self._include = [compileGlob(pattern) for pattern in self.include]
+        self._exclude = [compileGlob(pattern, subtree=True) for pattern in self.exclude]
+
+    def excluded(self, path: str) -> bool:
+        return any(pattern.match(path) for pattern in self._exclude)
+
+    def __call__(self, path: str) -> bool:
+        return (any(pattern.match(path) for pattern in self._include)
+                and not self.excluded(path))
+
+
+def _extension(name: str) -> str:
+    return os.path.splitext(name)[1].lower()
+
+
+class FolderIndex:
+    '''
+        the files of one workspace folder, by relative path
+    '''
+    def __init__(self, folder: WorkspaceFolder, root: str):
+        self.folder = folder
+        self.root = root
+        self.files: Set[str] = set()
+        self._byName: Dict[str, Set[str]] = {}
+        self._byExtension: Dict[str, Set[str]] = {}
+        self._sorted: Optional[List[str]] = None  # rebuilt on the first prefix lookup after a change
+        self.ready = threading.Event()
+        self.pending: List[Tuple[str, int]] = []  # events received while scanning
+
+    def add(self, path: str):
+        if path in self.files:
+            return
+        self.files.add(path)
+        name = path.rpartition('/')[2]
+        self._byName.setdefault(name, set()).add(path)
+        self._byExtension.setdefault(_extension(name), set()).add(path)
+        self._sorted = None
+
+    def discard(self, path: str):
+        if path not in self.files:
+            return
+        self.files.discard(path)
+        name = path.rpartition('/')[2]
+        for key, table in ((name, self._byName), (_extension(name), self._byExtension)):
+            paths = table[key]
+            paths.discard(path)
+            if not paths:
+                del table[key]
+        self._sorted = None
+
+    def discardTree(self, path: str):
+        for child in self.under(path + '/'):
+            self.discard(child)
+
+    def byName(self, name: str) -> Set[str]:
+        return self._byName.get(name, set())
+
+    def byExtension(self, extension: str) -> Set[str]:
+        return self._byExtension.get(extension.lower(), set())
+
+    def under(self, prefix: str) -> List[str]:
+        if self._sorted is None:
+            self._sorted = sorted(self.files)
+        start = bisect.bisect_left(self._sorted, prefix)
+        end = bisect.bisect_left(self._sorted, prefix + '\U0010ffff')
+        return self._sorted[start:end]
+
+    def absolute(self, path: str) -> str:
+        return os.path.join(self.root, *path.split('/'))
+
+
+class WorkspaceFileIndex:
+    '''
+        include, exclude: globs filtering the files indexed
+        workers: threads scanning the folders
+    '''
+    def __init__(self, include: Iterable[str] = ('**/*',), exclude: Iterable[str] = DEFAULT_EXCLUDE,
+                 workers: int = 8):
+        self.filter = GlobFilter(include, exclude)
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='file-index')
+        self._lock = threading.Lock()
+        self._folders: Dict[NormalizedUri, FolderIndex] = {}
+
+    @property
+    def include(self) -> Tuple[str, ...]:
+        return self.filter.include
+
+    def addFolder(self, folder: WorkspaceFolder):
+        '''
+            index folder, the scan runs in the background, see wait()
+        '''
+        key = normalizeUri(folder.uri)
+        index = FolderIndex(folder, uriTofsPath(folder.uri))
+        with self._lock:
+            if key in self._folders:
+                return
+            self._folders[key] = index
+            for outer in self._folders.values():
+                relative = self._relative(outer.root, index.root)
+                if relative is not None and outer.ready.is_set():
+                    outer.discardTree(relative)
+                # a scan still running drops it when it ends
+        threading.Thread(target=self._scan, args=(index,), name='file-index-scan',
+                         daemon=True).start()
+
+    def removeFolder(self, folder: WorkspaceFolder):
+        outers = []
+        with self._lock:
+            index = self._folders.pop(normalizeUri(folder.uri), None)
+            if index is None:
+                return
+            # the folders around it take its files back
+            for outer in self._folders.values():
+                relative = self._relative(outer.root, index.root)
+                if relative is None:
+                    continue
+                if outer.ready.is_set():
+                    outers.append((outer, relative, self._nested(outer)))
+                else:
+                    outer.pending.append((relative, FileChangeType.CREATED))
+        collected = [(outer, relative, self._collect(outer, relative, FileChangeType.CREATED, skip))
+                     for outer, relative, skip in outers]
+        with self._lock:
+            for outer, relative, files in collected:
+                self._merge(outer, relative, files)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        '''
+            whether every folder has been scanned before timeout
+        '''
+        with self._lock:
+            folders = list(self._folders.values())
+        return all(index.ready.wait(timeout) for index in folders)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _nested(self, index: FolderIndex) -> Set[str]:
+        ''' the relative paths of the folders inside index '''
+        nested = set()
+        for other in self._folders.values():
+            relative = self._relative(index.root, other.root)
+            if relative is not None:
+                nested.add(relative)
+        return nested
+
+    def _listdir(self, root: str, relative: str,
+                 skip: Iterable[str] = ()) -> Tuple[List[str], List[str]]:
+        files, dirs = [], []
+        try:
+            with os.scandir(os.path.join(root, relative) if relative else root) as entries:
+                for entry in entries:
+                    path = f'{relative}/{entry.name}' if relative else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if path not in skip and not self.filter.excluded(path):
+                                dirs.append(path)
+                        elif self.filter(path):
+                            files.append(path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f'Cannot list {os.path.join(root, relative)}: {e}')
+        return files, dirs
+
+    def _scan(self, index: FolderIndex):
+        found = []
+        with self._lock:
+            skip = self._nested(index)
+        try:
+            pending = {self._executor.submit(self._listdir, index.root, '', skip)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, dirs = future.result()
+                    found.extend(files)
+                    for path in dirs:
+                        pending.add(self._executor.submit(self._listdir, index.root, path, skip))
+        except (CancelledError, RuntimeError):
+            return  # closed
+        except Exception:  # pylint: disable=broad-except
+            logger.exception(f'Failed to index {index.root}')
+        # the events received meanwhile, walked outside the lock as well
+        collected = []
+        while True:
+            with self._lock:
+                events, index.pending = index.pending, []
+                if not events:
+                    for path in found:
+                        index.add(path)
+                    for path, files in collected:
+                        self._merge(index, path, files)
+                    # folders added inside it during the scan
+                    for relative in self._nested(index) - skip:
+                        index.discardTree(relative)
+                    index.ready.set()
+                    break
+                nested = self._nested(index)
+            collected.extend((path, self._collect(index, path, change, nested))
+                             for path, change in events)
+        logger.debug(f'Indexed {len(index.files)} files of {index.root}')
+
+    def applyChanges(self, changes: List[FileEvent]):
+        with self._lock:
+            folders = list(self._folders.values())
+        if not folders or not changes:
+            return
+        paths = urisTofsPaths([change.uri for change in changes], [index.root for index in folders])
+        # the innermost folder owns a path
+        folders.sort(key=lambda index: len(index.root), reverse=True)
+        ready = []
+        with self._lock:
+            nested = {}
+            for change, path in zip(changes, paths):
+                for index in folders:
+                    relative = self._relative(index.root, path)
+                    if relative is None:
+                        continue
+                    if index.ready.is_set():
+                        if index.root not in nested:
+                            nested[index.root] = self._nested(index)
+                        ready.append((index, relative, change.type, nested[index.root]))
+                    else:
+                        index.pending.append((relative, change.type))
+                    break
+        collected = [(index, relative, self._collect(index, relative, change, skip))
+                     for index, relative, change, skip in ready]
+        with self._lock:
+            for index, relative, files in collected:
+                self._merge(index, relative, files)
+
+    @staticmethod
+    def _relative(root: str, path: str) -> Optional[str]:
+        if os.name == 'nt':
+            root, path = root.replace('\\', '/'), path.replace('\\', '/')
+        root = root.rstrip('/')
+        if not path.startswith(root) or path[len(root):len(root) + 1] != '/':
+            return None
+        return path[len(root) + 1:]
+
+    def _collect(self, index: FolderIndex, path: str, change: int,
+                 skip: Iterable[str]) -> Optional[List[str]]:
+        '''
+            the files change brings in at path, None for a deletion. It reads
+            the disk, call it without holding the lock and _merge the result.
+        '''
+        if change == FileChangeType.DELETED:
+            return None
+        if os.path.isdir(index.absolute(path)):
+            if path in skip or self.filter.excluded(path):
+                return []
+            # a directory created or moved in
+            files, directories = [], [path]
+            while directories:
+                found, dirs = self._listdir(index.root, directories.pop(), skip)
+                files.extend(found)
+                directories.extend(dirs)
+            return files
+        return [path] if self.filter(path) else []
+
+    @staticmethod
+    def _merge(index: FolderIndex, path: str, files: Optional[List[str]]):
+        if files is None:
+            # a deleted directory takes everything below with it
+            index.discard(path)
+            index.discardTree(path)
+        else:
+            for file in files:
+                index.add(file)
+
+    def byName(self, name: str) -> List[str]:
+        with self._lock:
+            return [index.absolute(path) for index in self._folders.values() for path in index.byName(name)]
+
+    def byExtension(self, extension: str) -> List[str]:
+        '''
+            extension with its dot, '.py'
+        '''
+        with self._lock:
+            return [index.absolute(path) for index in self._folders.values()
+                    for path in index.byExtension(extension)]
+
+    def underPath(self, path: str) -> List[str]:
+        '''
+            the files in the directory path, at any depth
+        '''
+        path = path.rstrip('/\\')
+        result = []
+        with self._lock:
+            for index in self._folders.values():
+                # the folder is path or nested in it
+                if (os.path.normcase(path) == os.path.normcase(index.root.rstrip('/\\'))
+                        or self._relative(path, index.root) is not None):
+                    prefix = ''
+                else:
+                    relative = self._relative(index.root, path)
+                    if relative is None:
+                        continue
+                    prefix = relative + '/'
+                result.extend(index.absolute(child) for child in index.under(prefix))
+        return result
+
+    def __contains__(self, path: str) -> bool:
+        with self._lock:
+            for index in self._folders.values():
+                relative = self._relative(index.root, path)
+                if relative is not None and relative in index.files:
+                    return True
+        return False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(index.files) for index in self._folders.values())
@@ -2,10 +2,15 @@ from typing import Optional
 from enum import Enum
 import logging
 from .manager import ServerManager
+from .methodMap import no_op
+from .aio import AsyncServerManager
 from .response import InitializeResult, SimpleResult
 from . import param as p
 from . import constant as ct
 from .workspace import WorkSpace
+from .diagnostics import DiagnosticsScheduler
+from .fileindex import WorkspaceFileIndex
+from .struct import DidChangeWatchedFilesRegistrationOptions, FileSystemWatcher, Registration
 
 logger = logging.getLogger(__name__)
 
@@ -16,15 +21,31 @@ class ServerState(Enum):
     HANG = 2
 
 
+# cheapest first: utf-32 columns are str indexes
+_ENCODING_PREFERENCE = [ct.PositionEncodingKind.UTF32, ct.PositionEncodingKind.UTF16,
+                        ct.PositionEncodingKind.UTF8]
+
+
 class BasicLanguageServer:
     def __init__(self,
                  reader,
                  writer,
                  capability: Optional[dict] = None,
                  **kwargs):
+        '''
+            use_asyncio=True serves through AsyncServerManager, see aio.py for
+            its transport options. Handlers may be declared with async def.
+            diagnostics_delay is the debounce of self.diagnostics.
+            file_index, a WorkspaceFileIndex, is filled with the files of the
+            workspace folders and kept as self.files.
+        '''
         capability = capability if capability else {'textDocumentSync': ct.TextDocumentSyncKind.INCREMENTAL}
         self.state: ServerState = ServerState.HANG
-        self.manager = ServerManager(self, reader, writer, server_capability=capability)
+        manager_class = AsyncServerManager if kwargs.pop('use_asyncio', False) else ServerManager
+        diagnostics_delay = kwargs.pop('diagnostics_delay', 0.3)
+        self.files: Optional[WorkspaceFileIndex] = kwargs.pop('file_index', None)
+        self.manager = manager_class(self, reader, writer, server_capability=capability, **kwargs)
+        self.diagnostics = DiagnosticsScheduler(self.manager.send_diagnostics, diagnostics_delay)
         self.workspace = WorkSpace()
         self.user_settings = {}
         self.parent_processId = -1
@@ -36,6 +57,9 @@ class BasicLanguageServer:
     
     def close(self):
         self.state = ServerState.HANG
+        self.diagnostics.close()
+        if self.files is not None:
+            self.files.close()
         self.manager.exit()
 
     def onInitialize(self, param: p.InitializeParams,
@@ -47,13 +71,41 @@ class BasicLanguageServer:
             logger.debug(f'workspaceFolders: {param.workspaceFolders}')
         else:
             self.workspace.rootUri = param.rootUri if param.rootUri else ''
+        if self.files is not None:
+            for folder in self.workspace.workspaceFolders:
+                if folder.uri:
+                    self.files.addFolder(folder)
         logger.debug(f'capability: {param.capabilities.getDict()}')
         self.parent_processId = param.processId
         self.manager.update_client_capability(param.capabilities.getDict())
+        self.negotiatePositionEncoding(param.capabilities)
         return InitializeResult(self.manager.get_server_capability())
 
+    def negotiatePositionEncoding(self, capabilities) -> ct.PositionEncodingKind:
+        '''
+            pick the position encoding from general.positionEncodings of the
+            client, clients not sending it only support utf-16
+        '''
+        offered = capabilities.__get__('general.positionEncodings')
+        encoding = ct.PositionEncodingKind.UTF16
+        if offered:
+            for kind in _ENCODING_PREFERENCE:
+                if kind.value in offered:
+                    encoding = kind
+                    break
+            self.manager.update_server_capability({'positionEncoding': encoding.value})
+        self.workspace.positionEncoding = encoding
+        logger.debug(f'position encoding: {encoding.value}')
+        return encoding
+
     def onInitialized(self, param: p.InitializedParams, **kwargs) -> None:
         self.manager.ask_workspaceConfiguration(p.ConfigurationParams([p.ConfigurationItem(section='workbench')]))
+        if (self.files is not None and self.manager.get_client_capability().hasAttr(
+                'workspace.didChangeWatchedFiles.dynamicRegistration')):
+            watchers = [FileSystemWatcher(pattern) for pattern in self.files.include]
+            self.manager.register_capability(p.RegistrationParams([Registration(
+                'dpylsp.fileIndex', 'workspace/didChangeWatchedFiles',
+                DidChangeWatchedFilesRegistrationOptions(watchers))]))
 
     def onShutdown(self, param: p.NullParams, **kwargs) -> SimpleResult:
         self.state = ServerState.SHUTDOWN
@@ -62,18 +114,22 @@ class BasicLanguageServer:
     def onExit(self, param: p.NullParams, **kwargs) -> None:
         self.close()
 
+    @no_op
     def onDidOpenTextDocument(self, param: p.DidOpenTextDocumentParams,
                               **kwargs) -> None:
         return None
 
+    @no_op
     def onDidChangeTextDocument(self, param: p.DidChangeTextDocumentParams,
                                 **kwargs) -> None:
         return None
 
+    @no_op
     def onDidCloseTextDocument(self, param: p.DidCloseTextDocumentParams,
                                **kwargs) -> None:
         return None
 
+    @no_op
     def onDidSaveTextDocument(self, param: p.DidSaveTextDocumentParams,
                               **kwargs) -> None:
         return None
@@ -93,8 +149,18 @@ class BasicLanguageServer:
     def onDidChangeWorkspaceFolders(self, param: p.DidChangeWorkspaceFoldersParams, **kwargs) -> None:
         for added_folder in param.event.added:
             self.workspace.addFolder(added_folder)
+            if self.files is not None:
+                self.files.addFolder(added_folder)
         for removed_folder in param.event.removed:
             self.workspace.removeFolder(removed_folder)
+            if self.files is not None:
+                self.files.removeFolder(removed_folder)
+
+    def onDidChangeWatchedFiles(self, param: p.DidChangeWatchedFilesParams, **kwargs) -> None:
+        for change in param.changes:
+            self.workspace.mapped.invalidate(change.uri)
+        if self.files is not None:
+            self.files.applyChanges(param.changes)
 
 
 class LanguageServer(BasicLanguageServer):
@@ -111,14 +177,17 @@ class LanguageServer(BasicLanguageServer):
     def onDidOpenTextDocument(self, param: p.DidOpenTextDocumentParams,
                               **kwargs) -> None:
         textDocument = param.textDocument
-        self.workspace.addDocument(textDocument.uri, textDocument.text)
+        self.workspace.addDocument(textDocument.uri, textDocument.text,
+                                   textDocument.version)
 
     def onDidChangeTextDocument(self, param: p.DidChangeTextDocumentParams,
                                 **kwargs) -> None:
         self.workspace.updateDocument(param.textDocument.uri,
-                                      param.contentChanges)
+                                      param.contentChanges,
+                                      param.textDocument.version)
 
     def onDidCloseTextDocument(self, param: p.DidCloseTextDocumentParams,
                                **kwargs) -> None:
         textDocument = param.textDocument
         self.workspace.removeDocument(textDocument.uri)
+        self.diagnostics.forget(textDocument.uri)
@@ -1,44 +1,125 @@
 # https://github.com/palantir/python-language-server
+import asyncio
+import functools
+import inspect
 import logging
 import threading
-import copy
-from typing import Optional, Union
+import time
+from typing import Dict, Optional, Union
 from concurrent import futures
-from .streams import JsonRpcStreamReader, JsonRpcStreamWriter
-from .methodMap import event_map, WorkerType, capability_map
-from .dpylsp import LspItem
+from .streams import (JsonRpcStreamReader, BufferedJsonRpcStreamReader, JsonRpcStreamWriter,
+                      QueuedJsonRpcStreamWriter)
+from .codec import get_codec
+from .pipeline import ReaderPipeline
+from .telemetry import Telemetry
+from .methodMap import event_map, MessageMap, WorkerType, Priority, capability_map
+from .dpylsp import LazyParams, LspItem, SlottedLspItem
 from .param import (NullParams, PublishDiagnosticParams, ConfigurationParams,
                     CancelParams, ShowMessageParams, LogMessageParams, RegistrationParams, UnregistrationParams)
 from .struct import ResponseError
-from .exception import JsonRpcRequestCancelled, JsonRpcException
+from .exception import (JsonRpcRequestCancelled, JsonRpcContentModified, JsonRpcInvalidParams,
+                        JsonRpcException)
 from . import constant as ct
 from . import worker
 from .capability import ClientCapabilities, ServerCapabilities
+from .uri import normalizeUri
 
 logger = logging.getLogger(__name__)
 
 
 class ClientRequestRecord:
-    def __init__(self):
+    '''
+        Created when a request arrives. Handlers accepting a `token` keyword
+        receive it to notice a $/cancelRequest while they are running.
+    '''
+    def __init__(self, method: Optional[str] = None):
+        self.method = method
         self.cancelled = False
 
     def cancel(self):
         self.cancelled = True
 
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JsonRpcRequestCancelled()
+
+
+class DispatchEntry:
+    '''
+        how to route a method, resolved from event_map once
+        no_op: the handler is a default doing nothing, notifications skip it
+    '''
+    __slots__ = ('handler', 'param_type', 'request', 'worker', 'priority', 'key', 'limit',
+                 'internal', 'no_op')
+
+    def __init__(self, handler, param_type, request, worker, priority, key, limit,
+                 internal, no_op):
+        self.handler = handler
+        self.param_type = param_type
+        self.request = request
+        self.worker = worker
+        self.priority = priority
+        self.key = key
+        self.limit = limit
+        self.internal = internal
+        self.no_op = no_op
+
 
 class ServerRequestRecord:
-    def __init__(self, callback):
+    def __init__(self, callback, method: Optional[str] = None):
         self.callback = callback
+        self.method = method
 
     def run(self, result, error, *args, **kwargs):
         self.callback(result=result, error=error, **kwargs)
 
 
+_token_support = {}
+
+
+def _accepts_token(handler) -> bool:
+    func = getattr(handler, '__func__', handler)
+    if func not in _token_support:
+        try:
+            parameters = inspect.signature(func).parameters.values()
+        except (TypeError, ValueError):
+            parameters = []
+        _token_support[func] = any(
+            parameter.name == 'token' or parameter.kind == inspect.Parameter.VAR_KEYWORD
+            for parameter in parameters)
+    return _token_support[func]
+
+
 class ServerManager:
-    def __init__(self, masterServer, reader, writer, max_workers=5, server_capability):
+    def __init__(self, masterServer, reader, writer, server_capability, max_workers=5,
+                 editor_workers=1, aging=0.5, buffered_reader=False, json_codec: Optional[str] = None,
+                 queued_writer=False, write_max_batch=64, write_max_latency=0.001,
+                 pipelined=False, pipeline_queue_size=1024, telemetry=False,
+                 telemetry_interval: Optional[float] = None):
         self.master = masterServer
-        self.jsonreader = JsonRpcStreamReader(reader)
-        self.jsonwriter = JsonRpcStreamWriter(writer)
+        codec = get_codec(json_codec)
+        # per method histograms, see telemetry.py
+        self.telemetry: Optional[Telemetry] = Telemetry() if telemetry else None
+        if self.telemetry is not None and telemetry_interval:
+            self.telemetry.start_dump(telemetry_interval)
+        on_decoded = self._record_inbound if self.telemetry is not None else None
+        if buffered_reader:
+            # the pipeline decodes on its own thread and times it itself
+            self.jsonreader = BufferedJsonRpcStreamReader(
+                reader, codec, on_decoded=None if pipelined else on_decoded)
+        else:
+            self.jsonreader = JsonRpcStreamReader(reader, codec)
+        if queued_writer:
+            self.jsonwriter = QueuedJsonRpcStreamWriter(writer, codec,
+                                                        max_batch=write_max_batch,
+                                                        max_latency=write_max_latency)
+        else:
+            self.jsonwriter = JsonRpcStreamWriter(writer, codec)
+        # read, decode and dispatch on separate threads, see pipeline.py
+        self.pipeline: Optional[ReaderPipeline] = ReaderPipeline(
+            self.jsonreader, pipeline_queue_size, pipeline_queue_size,
+            on_decoded=on_decoded
+        ) if pipelined else None
 
         self._server_request = {}
         self._server_request_lock = threading.Lock()
@@ -50,9 +131,19 @@ class ServerManager:
         self._client_capability: ClientCapabilities = ClientCapabilities.fromDict({})
         self._server_capability: ServerCapabilities = ServerCapabilities.fromDict(server_capability)
         logger.info(self._server_capability)
+        self._registrations: Dict[str, str] = {}  # dynamic registration id -> method
+        self._registered_methods = frozenset()
+
+        # edit workspace, messages of one document are kept in order
+        self.editor = worker.Worker(name='editor', count=editor_workers, aging=aging)
+        self.normal = worker.Worker(name='normal', count=max_workers, aging=aging)
 
-        self.editor = worker.Worker(name='editor')  # edit workspace
-        self.normal = worker.Worker(name='normal')
+        # this server's routes, register_method leaves other managers alone
+        self.event_map: Dict[str, MessageMap] = dict(event_map)
+        # method -> DispatchEntry, per message routing is a single lookup
+        self._dispatch_table = {}
+        self._unknown_methods = set()
+        self.refresh_dispatch()
 
     def _getRequestId(self):
         ''' get an unique id for server's request '''
@@ -72,65 +163,210 @@ class ServerManager:
             logger.debug('assign to urgent worker(manager itself)')
             func(*args, **kwargs)
 
-    def _dispatch(self, message):
-        if 'method' in message:
-            handle_map = event_map.get(message['method'], None)
-            if handle_map is None:
-                if message['method'][:2] == r'$/' and 'id' in message:
-                    self._schedule(WorkerType.NORMAL,
-                                   self.send_error_response, message['id'],
-                                   ct.ErrorCodes.METHODNOTFOUND)
-                logging.warning(
-                    f"{message['method']} haven't been implemented")
+    def _schedule_keyed(self, worker_type, key, limit, priority, func, *args, **kwargs):
+        '''
+            like _schedule, with a Priority. At most limit tasks with the same
+            key run at once, in the order they were scheduled.
+        '''
+        if worker_type == WorkerType.URGENT:
+            self._schedule(worker_type, func, *args, **kwargs)
+        elif worker_type == WorkerType.EDITOR:
+            self.editor.submit(func, args, kwargs, key, limit, priority)
+        else:
+            self.normal.submit(func, args, kwargs, key, limit, priority)
+
+    def scheduler_stats(self) -> dict:
+        '''
+            queue depth and waiting time of each priority class per worker
+        '''
+        return {
+            target.name: {Priority(priority).name: stats
+                          for priority, stats in target.stats().items()}
+            for target in (self.editor, self.normal)
+        }
+
+    def pipeline_stats(self) -> Optional[dict]:
+        '''
+            counters of each stage of the input pipeline, None if not pipelined
+        '''
+        return self.pipeline.getDict() if self.pipeline is not None else None
+
+    def _compile_entry(self, method: str, handle_map) -> Optional[DispatchEntry]:
+        owner = self if handle_map.internal else self.master
+        handler = getattr(owner, handle_map.method, None)
+        if handler is None:
+            return None
+        if handle_map.worker == WorkerType.EDITOR:
+            key, limit = None, 1  # keyed by the document, see _dispatch
+        elif handle_map.concurrency:
+            key, limit = ('method', method), handle_map.concurrency
+        else:
+            key, limit = None, None
+        return DispatchEntry(
+            handler=handler,
+            param_type=handle_map.paramType,
+            request=handle_map.rpctype == 'Request',
+            worker=handle_map.worker,
+            priority=handle_map.priority,
+            key=key,
+            limit=limit,
+            internal=handle_map.internal,
+            no_op=getattr(getattr(handler, '__func__', handler), 'no_op', False),
+        )
+
+    def refresh_dispatch(self, methods=None):
+        '''
+            resolve the handlers of methods (all of self.event_map by
+            default) again, e.g. after replacing a handler of the server at
+            runtime
+        '''
+        for method in (self.event_map if methods is None else methods):
+            handle_map = self.event_map.get(method)
+            entry = self._compile_entry(method, handle_map) if handle_map else None
+            if entry is None:
+                self._dispatch_table.pop(method, None)
             else:
-                param_dict = message.get('params')
-                handler_name = handle_map.method
-
-                try:
-                    handler_param = handle_map.paramType.fromDict(
-                        param_dict
-                    ) if param_dict and handle_map.paramType else NullParams
-                except KeyError:
-                    logger.error('Parameter parse error: %s %s',
-                                 message['method'], str(param_dict))
-                    return
+                self._dispatch_table[method] = entry
 
-                if hasattr(self.master, handler_name):
-                    if handle_map.rpctype == 'Notification':
-                        self._schedule(handle_map.worker,
-                                       self._handle_notification, handler_name,
-                                       handler_param)
-                    elif handle_map.rpctype == 'Request':
-                        self._schedule(handle_map.worker, self._handle_request,
-                                       message['id'], handler_name,
-                                       handler_param)
+    def register_method(self, method: str, handle_map: MessageMap):
+        '''
+            handle a method registered at runtime, handle_map.method names
+            the handler of the server
+        '''
+        self.event_map[method] = handle_map
+        self.refresh_dispatch([method])
+
+    def unregister_method(self, method: str):
+        self.event_map.pop(method, None)
+        self._dispatch_table.pop(method, None)
+
+    def _unknown_method(self, message):
+        method = message['method']
+        if 'id' in message:
+            self._register_client_request(message['id'])
+            self._schedule_keyed(WorkerType.NORMAL, None, None, Priority.INTERACTIVE,
+                                 self.send_error_response, message['id'],
+                                 ct.ErrorCodes.METHODNOTFOUND)
+        if method not in self._unknown_methods:
+            self._unknown_methods.add(method)
+            logger.warning(f"{method} haven't been implemented")
 
+    def _dispatch(self, message):
+        method = message.get('method')
+        if method is None:
+            # a handler may be waiting for this answer
+            self._schedule_keyed(WorkerType.NORMAL, None, None, Priority.INTERACTIVE,
+                                 self._handle_response, **message)
+            return
+        entry = self._dispatch_table.get(method)
+        if entry is None:
+            self._unknown_method(message)
+            return
+        if entry.no_op and not entry.request:
+            return
+        param_dict = message.get('params')
+        # decoded by the handler's thread when it first reads it
+        handler_param = LazyParams(
+            entry.param_type, param_dict
+        ) if param_dict and entry.param_type else NullParams
+
+        key = entry.key
+        if entry.worker == WorkerType.EDITOR:
+            # messages of one document are kept in order
+            text_document = param_dict.get('textDocument') if isinstance(param_dict, dict) else None
+            uri = text_document.get('uri') if isinstance(text_document, dict) else None
+            # spelled like the workspace keys its documents
+            key = ('uri', normalizeUri(uri) if isinstance(uri, str) else None)
+        handle = self._handle_request if entry.request else self._handle_notification
+        if self.telemetry is not None:
+            handle = functools.partial(self._timed, method, time.perf_counter(), handle)
+        if entry.request:
+            record = self._register_client_request(message['id'], method)
+            self._schedule_keyed(entry.worker, key, entry.limit, entry.priority,
+                                 handle, message['id'], entry.handler, handler_param, record)
         else:
-            self._schedule(WorkerType.NORMAL, self._handle_response, **message)
+            self._schedule_keyed(entry.worker, key, entry.limit, entry.priority,
+                                 handle, entry.handler, handler_param)
 
-    def _handle_request(self, msg_id, name, param, **kwargs):
+    def _timed(self, method, queued, handle, *args, **kwargs):
+        '''
+            run handle(*args, **kwargs), recording its queue wait and run time
+        '''
+        started = time.perf_counter()
+        self.telemetry.record_time(method, 'queue_wait', started - queued)
+        try:
+            return handle(*args, **kwargs)
+        finally:
+            self.telemetry.record_time(method, 'handler', time.perf_counter() - started)
+
+    def _record_inbound(self, message, size, seconds):
+        method = message.get('method')
+        if method is None:
+            # the answer to one of our requests
+            with self._server_request_lock:
+                record = self._server_request.get(message.get('id'))
+            method = record.method if record else '$/response'
+        self.telemetry.record_time(method, 'decode', seconds)
+        self.telemetry.record(method, 'bytes_in', size)
+
+    def _write(self, message, method: Optional[str]):
+        telemetry = self.telemetry
+        if telemetry is None:
+            self.jsonwriter.write(message)
+            return
+        started = time.perf_counter()
+        frame = self.jsonwriter.encode(message)
+        if frame is None:
+            return
+        method = method or '$/response'
+        telemetry.record_time(method, 'encode', time.perf_counter() - started)
+        telemetry.record(method, 'bytes_out', len(frame))
+        self.jsonwriter.write_frame(frame)
+
+    def stats(self) -> dict:
+        '''
+            everything measured, served to the client by $/dpylsp/stats
+        '''
+        return {
+            'methods': self.telemetry.getDict() if self.telemetry is not None else None,
+            'scheduler': self.scheduler_stats(),
+            'pipeline': self.pipeline_stats(),
+        }
+
+    def _handle_stats_request(self, param: NullParams, **kwargs) -> dict:
+        return self.stats()
+
+    def _register_client_request(self, msg_id, method: Optional[str] = None) -> ClientRequestRecord:
+        with self._client_request_lock:
+            record = ClientRequestRecord(method)
+            self._client_request[msg_id] = record
+            return record
+
+    def _handle_request(self, msg_id, handler, param, record: ClientRequestRecord, **kwargs):
         '''
             handle request from client.
             msg_id: request's id
-            name: the handler's name of languageserver
+            handler: the bound handler of languageserver
             param: parameter
+            record: registered when the request was dispatched
             See https://github.com/palantir/python-language-server
         '''
+        if record.cancelled:
+            return  # cancelled while queued, the client has its answer
         try:
-            handler = getattr(self.master, name)
-        except:
-            logger.exception(f'No {name} method')
-        else:
-            with self._client_request_lock:
-                new_item = ClientRequestRecord()
-                self._client_request[msg_id] = new_item
-            result = handler(param)
-            logger.info(result)
-            if new_item.cancelled:
-                self.send_error_response(msg_id,
-                                         ct.ErrorCodes.REQUESTCANCELLED)
-            else:
-                self.send_response(msg_id, result)
+            result = self._call(handler, param, record)
+        except JsonRpcRequestCancelled:
+            return
+        except JsonRpcContentModified:
+            self.send_error_response(msg_id, ct.ErrorCodes.CONTENTMODIFIED)
+            return
+        except JsonRpcInvalidParams as error:
+            self.send_error_response(msg_id, ct.ErrorCodes.INVALIDPARAMS, str(error))
+            return
+        logger.info(result)
+        # a cancelled request was answered by _handle_cancel_notification
+        if not record.cancelled:
+            self.send_response(msg_id, result)
 
     def _handle_response(self, id, result=None, error=None, **kwargs):
         '''
@@ -145,52 +381,116 @@ class ServerManager:
                     # TODO: furthur modification
                     return
                 record.run(result=result, error=error, **kwargs)
-            self._server_request.pop(id)
 
-    def _handle_notification(self, name, param, **kwargs):
-        getattr(self.master, name)(param)
+    def _handle_notification(self, handler, param, **kwargs):
+        try:
+            self._call(handler, param)
+        except JsonRpcInvalidParams:
+            pass  # logged when decoding
 
-    def _handle_cancel_notification(self, msg_id):
+    def _call(self, handler, param, token: Optional[ClientRequestRecord] = None):
+        '''
+            run handler, an async handler gets an event loop of its own on
+            this worker thread. AsyncServerManager runs them on its loop.
+        '''
+        if token is not None and _accepts_token(handler):
+            result = handler(param, token=token)
+        else:
+            result = handler(param)
+        if inspect.iscoroutine(result):
+            result = asyncio.run(result)
+        return result
+
+    def _handle_cancel_notification(self, param: CancelParams):
+        '''
+            answer the request right away, its handler is skipped if it is
+            still queued and sees the token cancelled if it is running
+        '''
+        try:
+            msg_id = param.id
+        except JsonRpcInvalidParams:
+            return
         with self._client_request_lock:
             request_item = self._client_request.get(msg_id, None)
             if request_item:
                 request_item.cancel()
+        if request_item:
+            self.send_error_response(msg_id, ct.ErrorCodes.REQUESTCANCELLED)
 
     def start(self):
+        '''
+            serve until the client closes the stream
+        '''
         self.editor.start()
         self.normal.start()
+        if self.pipeline is not None:
+            self.pipeline.run(self._dispatch)
+            return
+        read_messages = getattr(self.jsonreader, 'read_messages', None)
+        if read_messages is not None:
+            # decoded straight out of the buffer, frames are only split
+            # into bytes for the pipeline
+            while True:
+                messages = read_messages()
+                if not messages:
+                    break
+                for message in messages:
+                    self._dispatch(message)
+            return
         while True:
-            new_json = self.jsonreader.read_message()
-            self._dispatch(new_json)
-            logger.debug(f'{threading.active_count()} threads active')
+            frame = self.jsonreader.read_frame()
+            if frame is None:
+                break
+            if self.telemetry is None:
+                new_json = self.jsonreader.decode(frame)
+            else:
+                started = time.perf_counter()
+                new_json = self.jsonreader.decode(frame)
+                if new_json is not None:
+                    self._record_inbound(new_json, len(frame), time.perf_counter() - started)
+            if new_json is not None:
+                self._dispatch(new_json)
 
     def exit(self):
-        self.jsonreader.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+        if self.pipeline is not None:
+            # the reader thread may be blocked on a pipe the client keeps
+            # open, holding the file's lock; it closes the reader itself
+            self.pipeline.stop()
+        else:
+            self.jsonreader.close()
         self.jsonwriter.close()
         self.editor.close()
         self.normal.close()
     
+    # updates replace the capability objects instead of changing them, so
+    # whoever got one from get_*_capability keeps a consistent snapshot
     def update_client_capability(self, capability: dict):
-        self._client_capability.update(capability)
+        self._client_capability = self._client_capability.merged(capability)
+
+    def update_server_capability(self, capability: dict):
+        self._server_capability = self._server_capability.merged(capability)
 
     def get_client_capability(self) -> ClientCapabilities:
         '''
-            this will return a deepcopy of client_capability
+            the current client capabilities, not to be modified. Their
+            values are read-only views, see DictLspItem
         '''
-        return copy.deepcopy(self._client_capability)
+        return self._client_capability
     
     def get_server_capability(self) -> ServerCapabilities:
         '''
-            this will return a deepcopy of server_capability
+            the current server capabilities, not to be modified
         '''
-        return copy.deepcopy(self._server_capability)
+        return self._server_capability
 
     def has_capability(self, method: str):
         require = capability_map.get(method, None)
         if not require:
             return False
-        else:
-            return (require.server in self._server_capability) and (require.client in self._client_capability)
+        return ((method in self._registered_methods or require.server in self._server_capability)
+                and require.client in self._client_capability)
 
     def send_request(self, method: str, param: LspItem, callback):
         '''
@@ -209,9 +509,9 @@ class ServerManager:
             'params': param_item
         }
         with self._server_request_lock:
-            self._server_request[msg_id] = ServerRequestRecord(callback)
+            self._server_request[msg_id] = ServerRequestRecord(callback, method)
 
-        self.jsonwriter.write(request)
+        self._write(request, method)
 
     def send_response(self,
                        id,
@@ -220,13 +520,13 @@ class ServerManager:
         with self._client_request_lock:
             if id in self._client_request:
                 result_item = result.getDict() if isinstance(
-                    result, LspItem) else result
+                    result, SlottedLspItem) else result
                 response = {'jsonrpc': '2.0', 'id': id}
                 if result_item:
                     response['result'] = result_item
                 if error:
                     response['error'] = error.getDict()
-                self.jsonwriter.write(response)
+                self._write(response, self._client_request[id].method)
                 self._client_request.pop(id, None)
     
     def send_error_response(self, id, error_code: ct.ErrorCodes, message=''):
@@ -238,7 +538,7 @@ class ServerManager:
                     'id': id,
                     'error': error_response.getDict()
                 }
-                self.jsonwriter.write(response)
+                self._write(response, self._client_request[id].method)
                 self._client_request.pop(id, None)
 
     def send_notification(self, method: str, param: LspItem):
@@ -248,7 +548,7 @@ class ServerManager:
             'method': method,
             'params': param_item
         }
-        self.jsonwriter.write(notification)
+        self._write(notification, method)
 
     def send_diagnostics(self, diagnostics: PublishDiagnosticParams):
         logger.debug(f'publish diagnostics: {diagnostics}')
@@ -278,9 +578,17 @@ class ServerManager:
     def register_capability(self, registerParam: RegistrationParams):
         def callback(result, error, *args, **kwargs):
             pass  # TODO: deal error code
+        for registration in registerParam.registrations:
+            self._registrations[registration.id] = registration.method
+        self._registered_methods = frozenset(self._registrations.values())
+        # the client may start sending these, pick up handlers added since
+        self.refresh_dispatch([registration.method for registration in registerParam.registrations])
         self.send_request('client/registerCapability', registerParam, callback)
     
     def unregister_capability(self, unregisterParam: UnregistrationParams):
         def callback(result, error, *args, **kwargs):
             pass  # TODO: deal error code
+        for unregistration in unregisterParam.unregistrations:
+            self._registrations.pop(unregistration.id, None)
+        self._registered_methods = frozenset(self._registrations.values())
         self.send_request('client/unregisterCapability', unregisterParam, callback)
@@ -0,0 +1,111 @@
+'''
+    The text of a file on disk, memory-mapped instead of read into a str.
+
+    MappedText has the reading methods of Rope, so a DocumentSnapshot over
+    it (workspace.MappedSnapshot) has the line and position API of open
+    documents. Only the lines asked for are decoded; the line starts are
+    found on first use. Files are decoded as UTF-8, invalid bytes replaced.
+'''
+import bisect
+import mmap
+import os
+import re
+from array import array
+from typing import Optional
+
+_LINE_BREAK = re.compile(rb'\r\n|\r|\n')
+_NON_ASCII = re.compile(rb'[\x80-\xff]')
+_STR_LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+
+class MappedText:
+    '''
+        Rope's reading methods over bytes, usually an mmap. Line starts are
+        kept in arrays with the length as a last entry, in bytes and, for
+        files that are not ASCII, in characters.
+    '''
+    __slots__ = ('_data', '_ascii', '_bytes', '_chars')
+
+    def __init__(self, data):
+        self._data = data
+        self._ascii: Optional[bool] = None
+        self._bytes: Optional[array] = None
+        self._chars: Optional[array] = None
+
+    def _decode(self, start: int, end: int) -> str:
+        return str(self._data[start:end], 'utf-8', 'replace')
+
+    def isascii(self) -> bool:
+        if self._ascii is None:
+            self._ascii = _NON_ASCII.search(self._data) is None
+        return self._ascii
+
+    def _byteStarts(self) -> array:
+        if self._bytes is None:
+            starts = array('q', [0])
+            starts.extend(match.end() for match in _LINE_BREAK.finditer(self._data))
+            starts.append(len(self._data))
+            self._bytes = starts
+        return self._bytes
+
+    def _charStarts(self) -> array:
+        if self._chars is None:
+            starts = self._byteStarts()
+            if self.isascii():
+                self._chars = starts
+            else:
+                # one pass over a decoded copy, dropped afterwards. Invalid
+                # bytes never swallow an ASCII line break, the lines agree.
+                text = self.text
+                chars = array('q', [0])
+                chars.extend(match.end() for match in _STR_LINE_BREAK.finditer(text))
+                chars.append(len(text))
+                self._chars = chars
+        return self._chars
+
+    def __len__(self) -> int:
+        if self.isascii():
+            return len(self._data)
+        return self._charStarts()[-1]
+
+    @property
+    def text(self) -> str:
+        ''' the whole text, decoded again on every call '''
+        return self._decode(0, len(self._data))
+
+    def slice(self, start: int, end: int) -> str:
+        length = len(self)
+        start = min(max(start, 0), length)
+        end = min(max(end, start), length)
+        if self.isascii():
+            return self._decode(start, end)
+        first, last = self.line_of(start), self.line_of(end)
+        starts = self._byteStarts()
+        base = self._charStarts()[first]
+        return self._decode(starts[first], starts[last + 1])[start - base:end - base]
+
+    @property
+    def line_count(self) -> int:
+        return len(self._byteStarts()) - 1
+
+    def line_start(self, line: int) -> int:
+        if line <= 0:
+            return 0
+        if line >= self.line_count:
+            return len(self)
+        return self._charStarts()[line]
+
+    def line_of(self, offset: int) -> int:
+        if offset <= 0:
+            return 0
+        chars = self._charStarts()
+        return bisect.bisect_right(chars, min(offset, chars[-1]), 0, self.line_count) - 1
+
+
+def mapFile(file) -> MappedText:
+    '''
+        the text of the open binary file, which may be closed afterwards
+    '''
+    size = os.fstat(file.fileno()).st_size
+    # an empty file cannot be mapped
+    return MappedText(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b'')
@@ -1,6 +1,7 @@
 '''
     This file should not be exposed to the user
 '''
+from typing import Optional
 from . import param as p
 from enum import IntEnum
 
@@ -13,29 +14,62 @@ class WorkerType(IntEnum):
     NORMAL = 2
     URGENT = 3  # events we need to respond immediately(shutdown...)
 
+
+class Priority(IntEnum):
+    '''
+        order in which a worker serves queued events, lower first.
+        Waiting events are promoted over time so none starves.
+    '''
+    INTERACTIVE = 0  # the user waits for it (hover, completion...)
+    NORMAL = 1
+    BACKGROUND = 2  # indexing, diagnostics...
+
+def no_op(handler):
+    '''
+        marks a default handler that does nothing, ServerManager skips the
+        notifications it would receive unless a subclass overrides it
+    '''
+    handler.no_op = True
+    return handler
+
+
 class MessageMap:
-    def __init__(self, rpctype, method=None, resultType=None, paramType=None, worker=WorkerType.NORMAL):
+    '''
+        concurrency: how many messages of this method the NORMAL worker may
+        run at once, None for no limit
+        internal: method is handled by ServerManager instead of the server
+        priority: see Priority
+    '''
+    def __init__(self, rpctype, method=None, resultType=None, paramType=None, worker=WorkerType.NORMAL,
+                 concurrency: Optional[int] = None, internal=False, priority=Priority.NORMAL):
         self.rpctype = rpctype
         self.method = method
         self.resultType = resultType
         self.paramType = paramType
         self.worker = worker
+        self.concurrency = concurrency
+        self.internal = internal
+        self.priority = priority
 
 
 class N_Map(MessageMap):
     '''
         Notification map
     '''
-    def __init__(self, method: str, paramType=None, worker=WorkerType.NORMAL):
-        super().__init__('Notification', method=method, paramType=paramType, worker=worker)
+    def __init__(self, method: str, paramType=None, worker=WorkerType.NORMAL,
+                 concurrency: Optional[int] = None, internal=False, priority=Priority.NORMAL):
+        super().__init__('Notification', method=method, paramType=paramType, worker=worker,
+                         concurrency=concurrency, internal=internal, priority=priority)
 
 
 class Rq_Map(MessageMap):
     '''
         Request map
     '''
-    def __init__(self, method: str, paramType=None, worker=WorkerType.NORMAL):
-        super().__init__('Request', method=method, paramType=paramType, worker=worker)
+    def __init__(self, method: str, paramType=None, worker=WorkerType.NORMAL,
+                 concurrency: Optional[int] = None, internal=False, priority=Priority.NORMAL):
+        super().__init__('Request', method=method, paramType=paramType, worker=worker,
+                         concurrency=concurrency, internal=internal, priority=priority)
 
 
 class Rp_Map(MessageMap):
@@ -51,7 +85,7 @@ event_map = {
     Rq_Map('onInitialize', p.InitializeParams, worker=WorkerType.URGENT),
 
     'initialized':
-    N_Map('onInitialized', p.InitializedParams),
+    N_Map('onInitialized', p.InitializedParams, priority=Priority.INTERACTIVE),
 
     # shutdown shouldn't be dispatched to another thread because that thread may join itself
     'shutdown':
@@ -60,6 +94,14 @@ event_map = {
     'exit':
     N_Map('onExit', p.NullParams, worker=WorkerType.URGENT),
 
+    # answered by the reader thread so it overtakes the queued work
+    '$/cancelRequest':
+    N_Map('_handle_cancel_notification', p.CancelParams, worker=WorkerType.URGENT, internal=True),
+
+    # answered from the reader thread, so it still works when the workers are stuck
+    '$/dpylsp/stats':
+    Rq_Map('_handle_stats_request', p.NullParams, worker=WorkerType.URGENT, internal=True),
+
     'textDocument/didOpen':
     N_Map('onDidOpenTextDocument', p.DidOpenTextDocumentParams, worker=WorkerType.EDITOR),
 
@@ -70,13 +112,18 @@ event_map = {
     N_Map('onDidCloseTextDocument', p.DidCloseTextDocumentParams, worker=WorkerType.EDITOR),
 
     'textDocument/didSave':
-    N_Map('onDidSaveTextDocument', p.DidSaveTextDocumentParams, worker=WorkerType.EDITOR),
+    N_Map('onDidSaveTextDocument', p.DidSaveTextDocumentParams, worker=WorkerType.EDITOR,
+          priority=Priority.BACKGROUND),
 
+    # settings and folders are replaced wholesale, keep them in order
     'workspace/didChangeConfiguration':
-    N_Map('onDidChangeConfiguration', p.DidChangeConfigurationParams),
+    N_Map('onDidChangeConfiguration', p.DidChangeConfigurationParams, concurrency=1),
 
     'workspace/didChangeWorkspaceFolders':
-    N_Map('onDidChangeWorkspaceFolders', p.DidChangeWorkspaceFoldersParams),
+    N_Map('onDidChangeWorkspaceFolders', p.DidChangeWorkspaceFoldersParams, concurrency=1),
+
+    'workspace/didChangeWatchedFiles':
+    N_Map('onDidChangeWatchedFiles', p.DidChangeWatchedFilesParams, concurrency=1),
 }
 
 
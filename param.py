@@ -3,7 +3,8 @@ from .capability import ClientCapabilities
 from .dpylsp import LspItem
 from .struct import (TextDocumentItem, VersionedTextDocumentIdentifier,
                    TextDocumentContentChangeEvent, TextDocumentIdentifier, DocumentUri, Diagnostic,
-                   WorkspaceFolder, WorkspaceFoldersChangeEvent, Registration, Unregistration)
+                   WorkspaceFolder, WorkspaceFoldersChangeEvent, Registration, Unregistration,
+                   FileEvent)
 from .config import ConfigurationItem
 
 import logging
@@ -75,6 +76,15 @@ class DidChangeWorkspaceFoldersParams(LspItem):
         return cls(WorkspaceFoldersChangeEvent.fromDict(param['event']))
 
 
+class DidChangeWatchedFilesParams(LspItem):
+    def __init__(self, changes: List[FileEvent], **kwargs):
+        self.changes = changes
+
+    @classmethod
+    def fromDict(cls, param):
+        return cls([FileEvent.fromDict(change) for change in param['changes']])
+
+
 class DidChangeConfigurationParams(LspItem):
     def __init__(self, settings, **kwargs):
         self.settings = settings
@@ -147,16 +157,17 @@ class DidSaveTextDocumentParams(LspItem):
 
 class PublishDiagnosticParams(LspItem):
     def __init__(self, uri: DocumentUri, diagnostics: List[Diagnostic],
-                 **kwargs):
+                 version: Optional[int] = None, **kwargs):
         self.uri = uri
         self.diagnostics = diagnostics
+        self.version = version
 
     @classmethod
     def fromDict(cls, param: dict):
         diags = []
         for diag_dict in param['diagnostics']:
             diags.append(Diagnostic.fromDict(diag_dict))
-        return cls(uri=param['uri'], diagnostics=diags)
+        return cls(uri=param['uri'], diagnostics=diags, version=param.get('version'))
 
 
 # capability
@@ -0,0 +1,150 @@
+'''
+    Staged input for ServerManager.
+
+    A reader thread only frames messages off the client pipe, a decoder
+    thread parses them and the thread calling run() dispatches them. The
+    stages are connected by bounded queues, so a slow URGENT handler or a
+    big parse does not stop the pipe from being drained until the queues
+    fill up.
+'''
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_EOF = None
+
+
+class StageStats:
+    '''
+        counters of one stage, updated by its thread only
+        busy: seconds spent working on items
+        blocked: seconds spent waiting for room in the next queue
+    '''
+    def __init__(self):
+        self.items = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.max_depth = 0  # of the queue feeding the next stage
+
+    def getDict(self):
+        return dict(vars(self))
+
+
+class ReaderPipeline:
+    '''
+        reader: a JsonRpcStreamReader, read_frame() feeds the first stage and
+                decode() the second
+        max_frames, max_messages: bounds of the queues between the stages
+        on_decoded: called by the decoder with each message, the size of its
+                    body and the seconds spent parsing it
+    '''
+    def __init__(self, reader, max_frames=1024, max_messages=1024, on_decoded=None):
+        self._reader = reader
+        self._on_decoded = on_decoded
+        self._frames = queue.Queue(max_frames)
+        self._messages = queue.Queue(max_messages)
+        self._threads = [
+            threading.Thread(target=self._read, name='jsonrpc-reader', daemon=True),
+            threading.Thread(target=self._decode, name='jsonrpc-decoder', daemon=True),
+        ]
+        self.stats = {'read': StageStats(), 'decode': StageStats(), 'dispatch': StageStats()}
+        self._stopped = False
+
+    def getDict(self):
+        result = {name: stats.getDict() for name, stats in self.stats.items()}
+        result['read']['depth'] = self._frames.qsize()
+        result['decode']['depth'] = self._messages.qsize()
+        return result
+
+    def run(self, dispatch):
+        '''
+            call dispatch with every message until the stream ends
+        '''
+        for thread in self._threads:
+            thread.start()
+        stats = self.stats['dispatch']
+        while not self._stopped:
+            message = self._messages.get()
+            if message is _EOF or self._stopped:
+                break
+            started = time.perf_counter()
+            try:
+                dispatch(message)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Failed to dispatch %s', message)
+            stats.busy += time.perf_counter() - started
+            stats.items += 1
+
+    def stop(self):
+        '''
+            make run() return after the message it is dispatching, without
+            waiting for the client to close the stream. The reader is closed
+            by the reader thread once its read returns: closing a file
+            another thread is reading blocks until that read ends.
+        '''
+        self._stopped = True
+        if not self._threads[0].is_alive():
+            self._reader.close()  # already at the end of the stream, or never started
+        for target in (self._frames, self._messages):
+            try:
+                target.put_nowait(_EOF)
+            except queue.Full:
+                pass  # run() checks _stopped after every message
+
+    @staticmethod
+    def _put(target: queue.Queue, item, stats: StageStats):
+        try:
+            target.put_nowait(item)
+        except queue.Full:
+            started = time.perf_counter()
+            target.put(item)
+            stats.blocked += time.perf_counter() - started
+        depth = target.qsize()
+        if depth > stats.max_depth:
+            stats.max_depth = depth
+
+    def _read(self):
+        stats = self.stats['read']
+        read_frame = self._reader.read_frame
+        try:
+            while True:
+                # no busy time, it could not be told apart from an idle pipe
+                frame = read_frame()
+                if frame is None or self._stopped:
+                    break
+                stats.items += 1
+                stats.bytes += len(frame)
+                self._put(self._frames, frame, stats)
+        except Exception:  # pylint: disable=broad-except
+            if not self._stopped:
+                logger.exception('Failed to read from the client')
+        finally:
+            if self._stopped:
+                self._reader.close()
+            self._frames.put(_EOF)
+
+    def _decode(self):
+        stats = self.stats['decode']
+        decode = self._reader.decode
+        try:
+            while True:
+                frame = self._frames.get()
+                if frame is _EOF:
+                    break
+                started = time.perf_counter()
+                message = decode(frame)
+                elapsed = time.perf_counter() - started
+                stats.busy += elapsed
+                if message is None:
+                    continue  # logged by decode
+                if self._on_decoded is not None:
+                    self._on_decoded(message, len(frame), elapsed)
+                stats.items += 1
+                stats.bytes += len(frame)
+                self._put(self._messages, message, stats)
+        finally:
+            self._messages.put(_EOF)
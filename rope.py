@@ -0,0 +1,247 @@
+'''
+    A persistent rope used as the backing store of workspace documents.
+
+    Nodes are never mutated once built: an edit creates O(log n) new nodes
+    and shares everything else with the previous version.
+'''
+import re
+from typing import List, Optional
+
+LEAF_SIZE = 1024  # size of the chunks a fresh text is cut into
+LEAF_MAX = 2048  # neighbouring leaves are merged while they stay below this
+
+_LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+
+def _count_breaks(text: str) -> int:
+    return text.count('\n') + text.count('\r') - text.count('\r\n')
+
+
+class _Leaf:
+    __slots__ = ('text', 'length', 'newlines', 'height', 'starts_lf',
+                 'ends_cr', 'ascii')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.length = len(text)
+        self.newlines = _count_breaks(text)
+        self.height = 0
+        self.starts_lf = text[:1] == '\n'
+        self.ends_cr = text[-1:] == '\r'
+        self.ascii = text.isascii()
+
+
+class _Node:
+    '''
+        newlines counts '\\r\\n' once even when it straddles the children,
+        in which case the left child counted its trailing '\\r' as a break.
+    '''
+    __slots__ = ('left', 'right', 'length', 'newlines', 'height',
+                 'starts_lf', 'ends_cr', 'ascii')
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = left.length + right.length
+        self.newlines = left.newlines + right.newlines - _straddle(left, right)
+        self.height = max(left.height, right.height) + 1
+        self.starts_lf = left.starts_lf
+        self.ends_cr = right.ends_cr
+        self.ascii = left.ascii and right.ascii
+
+
+def _straddle(left, right) -> int:
+    return 1 if left.ends_cr and right.starts_lf else 0
+
+
+def _balance(left, right):
+    diff = left.height - right.height
+    if diff > 1:
+        if left.left.height >= left.right.height:
+            return _Node(left.left, _Node(left.right, right))
+        inner = left.right
+        return _Node(_Node(left.left, inner.left), _Node(inner.right, right))
+    if diff < -1:
+        if right.right.height >= right.left.height:
+            return _Node(_Node(left, right.left), right.right)
+        inner = right.left
+        return _Node(_Node(left, inner.left), _Node(inner.right, right.right))
+    return _Node(left, right)
+
+
+def _join(left, right):
+    if left is None or left.length == 0:
+        return right
+    if right is None or right.length == 0:
+        return left
+    if left.height == 0 and right.height == 0 \
+            and left.length + right.length <= LEAF_MAX:
+        return _Leaf(left.text + right.text)
+    diff = left.height - right.height
+    if diff > 1:
+        return _balance(left.left, _join(left.right, right))
+    if diff < -1:
+        return _balance(_join(left, right.left), right.right)
+    return _Node(left, right)
+
+
+def _split(node, offset: int):
+    if node is None:
+        return None, None
+    if offset <= 0:
+        return None, node
+    if offset >= node.length:
+        return node, None
+    if node.height == 0:
+        return _Leaf(node.text[:offset]), _Leaf(node.text[offset:])
+    left_length = node.left.length
+    if offset < left_length:
+        first, second = _split(node.left, offset)
+        return first, _join(second, node.right)
+    first, second = _split(node.right, offset - left_length)
+    return _join(node.left, first), second
+
+
+def _build(leaves: List[_Leaf]):
+    if not leaves:
+        return None
+    while len(leaves) > 1:
+        paired = [
+            _Node(leaves[i], leaves[i + 1])
+            for i in range(0, len(leaves) - 1, 2)
+        ]
+        if len(leaves) % 2:
+            paired.append(leaves[-1])
+        leaves = paired
+    return leaves[0]
+
+
+def _from_text(text: str):
+    if not text:
+        return None
+    return _build([
+        _Leaf(text[i:i + LEAF_SIZE]) for i in range(0, len(text), LEAF_SIZE)
+    ])
+
+
+def _collect(node, start: int, end: int, out: List[str]):
+    ''' append node's text within [start, end) to out '''
+    stack = [(node, start, end)]
+    while stack:
+        node, start, end = stack.pop()
+        if node is None or start >= end:
+            continue
+        if node.height == 0:
+            out.append(node.text[start:end] if start > 0
+                       or end < node.length else node.text)
+            continue
+        left_length = node.left.length
+        if end > left_length:
+            stack.append((node.right, max(start - left_length, 0),
+                          end - left_length))
+        if start < left_length:
+            stack.append((node.left, start, min(end, left_length)))
+
+
+class Rope:
+    '''
+        Immutable text. Every editing method returns a new Rope.
+    '''
+    __slots__ = ('_root', '_text')
+
+    def __init__(self, text: str = ''):
+        self._root = _from_text(text)
+        self._text: Optional[str] = text
+
+    @classmethod
+    def _fromRoot(cls, root) -> 'Rope':
+        rope = cls.__new__(cls)
+        rope._root = root
+        rope._text = None
+        return rope
+
+    def __len__(self) -> int:
+        return self._root.length if self._root else 0
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            out: List[str] = []
+            _collect(self._root, 0, len(self), out)
+            self._text = ''.join(out)
+        return self._text
+
+    def slice(self, start: int, end: int) -> str:
+        length = len(self)
+        start = min(max(start, 0), length)
+        end = min(max(end, start), length)
+        if start == 0 and end == length and self._text is not None:
+            return self._text
+        out: List[str] = []
+        _collect(self._root, start, end, out)
+        return ''.join(out)
+
+    def splice(self, start: int, end: int, text: str) -> 'Rope':
+        '''
+            replace [start, end) with text
+        '''
+        length = len(self)
+        start = min(max(start, 0), length)
+        end = min(max(end, start), length)
+        head, rest = _split(self._root, start)
+        _, tail = _split(rest, end - start)
+        return Rope._fromRoot(_join(_join(head, _from_text(text)), tail))
+
+    def isascii(self) -> bool:
+        return self._root.ascii if self._root else True
+
+    @property
+    def line_count(self) -> int:
+        return self._root.newlines + 1 if self._root else 1
+
+    def line_start(self, line: int) -> int:
+        '''
+            offset of the first character of line, lines are separated by
+            '\\n', '\\r\\n' or '\\r' (see struct.EOL)
+        '''
+        if line <= 0 or self._root is None:
+            return 0
+        if line > self._root.newlines:
+            return len(self)
+        node, offset = self._root, 0
+        while node.height:
+            left, right = node.left, node.right
+            count = left.newlines - _straddle(left, right)
+            if line <= count:
+                node = left
+            else:
+                line -= count
+                offset += left.length
+                node = right
+        for i, match in enumerate(_LINE_BREAK.finditer(node.text), 1):
+            if i == line:
+                return offset + match.end()
+        return offset + node.length  # unreachable for a consistent tree
+
+    def line_of(self, offset: int) -> int:
+        '''
+            the line the character at offset belongs to
+        '''
+        node = self._root
+        if node is None or offset <= 0:
+            return 0
+        offset = min(offset, node.length)
+        line = 0
+        while node.height:
+            left, right = node.left, node.right
+            if offset < left.length:
+                node = left
+            else:
+                line += left.newlines - _straddle(left, right)
+                offset -= left.length
+                node = right
+        text = node.text
+        line += _count_breaks(text[:offset])
+        if text[offset - 1:offset] == '\r' and text[offset:offset + 1] == '\n':
+            line -= 1
+        return line
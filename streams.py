@@ -1,20 +1,22 @@
 # Copyright 2018 Palantir Technologies, Inc.
+import collections
 import logging
+import queue
+import re
 import threading
+import time
 from concurrent import futures
 
-try:
-    import ujson as json
-except Exception:  # pylint: disable=broad-except
-    import json
+from .codec import get_codec
 
 log = logging.getLogger(__name__)
 
 
 class JsonRpcStreamReader(object):
 
-    def __init__(self, rfile):
+    def __init__(self, rfile, codec=None):
         self._rfile = rfile
+        self._codec = codec or get_codec()
 
     def close(self):
         self._rfile.close()
@@ -25,6 +27,17 @@ class JsonRpcStreamReader(object):
         Returns:
             A json
         """
+        body = self.read_frame()
+        if body is None:
+            return None
+        return self.decode(body)
+
+    def read_frame(self):
+        """Reads the body of a message without decoding it.
+
+        Returns:
+            The body as bytes, or None at the end of the stream
+        """
         try:
             line = self._rfile.readline()
 
@@ -41,19 +54,25 @@ class JsonRpcStreamReader(object):
                 return None
 
             # Grab the body
-            result = self._rfile.read(content_length)
-        except ValueError:
-            if self._rfile.closed():
+            body = self._rfile.read(content_length)
+            if not body and content_length != 0:
                 return None
-            else:
-                log.exception("Failed to read from rfile")
-        else:
-            if result is None:
+            return body
+        except ValueError:
+            if self._rfile.closed:
                 return None
-            try:
-                return json.loads(result.decode('utf-8'))
-            except ValueError:
-                log.exception(f"Failed to parse {result}")
+            log.exception("Failed to read from rfile")
+            return None
+
+    def decode(self, body):
+        """Parses the body of a message, None if it is not valid json."""
+        try:
+            if self._codec.accepts_buffer:
+                return self._codec.loads(body)
+            return self._codec.loads(str(body, 'utf-8'))
+        except ValueError:
+            log.exception(f"Failed to parse {body}")
+            return None
 
     @staticmethod
     def _content_length(line):
@@ -69,11 +88,158 @@ class JsonRpcStreamReader(object):
         return None
 
 
+class BufferedJsonRpcStreamReader(JsonRpcStreamReader):
+    """Reads with readinto() into one large buffer and frames every complete
+    message in it, so several queued messages cost a single read call.
+    """
+
+    _HEADER_END = b'\r\n\r\n'
+    # the Content-Length line followed by any other header lines
+    _HEADER = re.compile(
+        rb'(?:[^\r\n]+\r\n)*?Content-Length: *(\d+)\r\n(?:[^\r\n]+\r\n)*\r\n')
+
+    def __init__(self, rfile, codec=None, buffer_size=1 << 16, on_decoded=None):
+        super(BufferedJsonRpcStreamReader, self).__init__(rfile, codec)
+        # called by read_message(s) with each message, the size of its body
+        # and the seconds spent parsing it
+        self._on_decoded = on_decoded
+        self._buffer = bytearray(buffer_size)
+        self._start = 0  # first byte not framed yet
+        self._end = 0  # end of the bytes read so far
+        self._messages = collections.deque()
+        self._readinto = getattr(rfile, 'readinto1', None) or rfile.readinto
+
+    def read_message(self):
+        """Reads the contents of a message.
+
+        Returns:
+            A json, or None at the end of the stream
+        """
+        while not self._messages:
+            if not self._fill():
+                return None
+            self._frame(True)
+        return self._messages.popleft()
+
+    def read_frame(self):
+        """Reads the body of a message without decoding it.
+
+        Returns:
+            The body as bytes, or None at the end of the stream
+        """
+        while not self._messages:
+            if not self._fill():
+                return None
+            self._frame(False)
+        return self._messages.popleft()
+
+    def read_messages(self):
+        """Returns every message that is already framed, reading only if
+        there is none. An empty list means the end of the stream.
+        """
+        message = self.read_message()
+        if message is None:
+            return []
+        messages = [message]
+        messages.extend(self._messages)
+        self._messages.clear()
+        return messages
+
+    def _fill(self):
+        buf = self._buffer
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._start and len(buf) - self._end < len(buf) // 4:
+            # move the partial message to the front
+            buf[:self._end - self._start] = buf[self._start:self._end]
+            self._end -= self._start
+            self._start = 0
+        if self._end == len(buf):
+            buf.extend(bytes(len(buf)))
+        try:
+            with memoryview(buf)[self._end:] as view:
+                count = self._readinto(view)
+        except ValueError:
+            if self._rfile.closed:
+                return False
+            log.exception("Failed to read from rfile")
+            return False
+        if not count:
+            return False
+        self._end += count
+        return True
+
+    def _frame(self, decode):
+        """Frames every complete message in the buffer, decoded or as bytes
+        copied out of it.
+        """
+        buf = self._buffer
+        match_header = self._HEADER.match
+        loads = self._codec.loads
+        accepts_buffer = self._codec.accepts_buffer
+        on_decoded = self._on_decoded
+        messages = self._messages
+        start, end = self._start, self._end
+        with memoryview(buf) as view:
+            while True:
+                header = match_header(buf, start, end)
+                if header is None:
+                    header_end = buf.find(self._HEADER_END, start, end)
+                    if header_end < 0:
+                        break
+                    log.error("Missing Content-Length header: %s",
+                              bytes(buf[start:header_end]))
+                    start = header_end + len(self._HEADER_END)
+                    continue
+                body_start = header.end()
+                body_end = body_start + int(header.group(1))
+                if body_end > end:
+                    break
+                start = body_end
+                if not decode:
+                    # the buffer is reused, the body must outlive it
+                    messages.append(bytes(view[body_start:body_end]))
+                    continue
+                if accepts_buffer:
+                    body = view[body_start:body_end]
+                else:
+                    # str() decodes straight out of the buffer without a copy
+                    body = str(view[body_start:body_end], 'utf-8')
+                try:
+                    if on_decoded is None:
+                        messages.append(loads(body))
+                    else:
+                        started = time.perf_counter()
+                        message = loads(body)
+                        on_decoded(message, body_end - body_start,
+                                   time.perf_counter() - started)
+                        messages.append(message)
+                except ValueError:
+                    log.exception(f"Failed to parse {body}")
+        self._start = start
+        if header is not None and body_end - start > len(buf):
+            self._reserve(body_end - start)
+
+    def _reserve(self, size):
+        """Makes room for a message of size bytes starting at _start."""
+        buf = self._buffer
+        pending = self._end - self._start
+        grown = bytearray(max(size, 2 * len(buf)))
+        grown[:pending] = buf[self._start:self._end]
+        self._buffer = grown
+        self._start = 0
+        self._end = pending
+
+
 class JsonRpcStreamWriter(object):
 
-    def __init__(self, wfile, **json_dumps_args):
+    _HEADER = (b"Content-Length: %d\r\n"
+               b"Content-Type: application/vscode-jsonrpc; charset=utf8\r\n\r\n")
+
+    def __init__(self, wfile, codec=None, **json_dumps_args):
         self._wfile = wfile
         self._wfile_lock = threading.Lock()
+        self._codec = codec or get_codec()
         self._json_dumps_args = json_dumps_args
 
     def close(self):
@@ -81,22 +247,141 @@ class JsonRpcStreamWriter(object):
             self._wfile.close()
 
     def write(self, message):
+        frame = self.encode(message)
+        if frame is not None:
+            self.write_frame(frame)
+
+    def encode(self, message):
+        """Returns the message with its header as bytes, None if it cannot
+        be encoded.
+        """
+        try:
+            body = self._codec.dumps_bytes(message, **self._json_dumps_args)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Failed to encode message %s", message)
+            return None
+        return self._HEADER % len(body) + body
+
+    def write_frame(self, frame):
+        """Writes a message returned by encode()."""
         with self._wfile_lock:
             if self._wfile.closed:
                 return
             try:
-                body = json.dumps(message, **self._json_dumps_args)
+                self._wfile.write(frame)
+                self._wfile.flush()
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Failed to write message to output file")
+
+
+class WriterStats(object):
+    """Counters of a QueuedJsonRpcStreamWriter, updated by its threads."""
+
+    def __init__(self):
+        self.messages = 0
+        self.batches = 0
+        self.bytes = 0
+        self.max_depth = 0
+        self.blocked_writes = 0  # write() calls that found the queue full
+        self.blocked_time = 0.0  # seconds callers spent waiting for room
+
+    def getDict(self):
+        return dict(vars(self))
 
-                # Ensure we get the byte length, not the character length
-                content_length = len(body) if isinstance(body, bytes) else len(body.encode('utf-8'))
 
-                response = (
-                    "Content-Length: {}\r\n"
-                    "Content-Type: application/vscode-jsonrpc; charset=utf8\r\n\r\n"
-                    "{}".format(content_length, body)
-                )
+class QueuedJsonRpcStreamWriter(JsonRpcStreamWriter):
+    """Callers only encode and enqueue; a writer thread drains the queue and
+    sends up to max_batch messages with a single write and flush.
 
-                self._wfile.write(response.encode('utf-8'))
+    max_latency is how long the writer waits for more messages to join a
+    batch once it has one. A full queue (max_queue) blocks the callers
+    until there is room or the writer is closed. Messages written after
+    close() are dropped.
+    """
+
+    _CLOSE = None
+
+    def __init__(self, wfile, codec=None, max_batch=64, max_latency=0.001,
+                 max_queue=1024, **json_dumps_args):
+        super(QueuedJsonRpcStreamWriter, self).__init__(wfile, codec, **json_dumps_args)
+        self._queue = queue.Queue(max_queue)
+        self._max_batch = max_batch
+        self._max_latency = max_latency
+        self.stats = WriterStats()
+        self._closed = False
+        self._thread = threading.Thread(target=self._drain, name='jsonrpc-writer',
+                                        daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Writes everything already queued, then closes the file."""
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(self._CLOSE)
+            self._thread.join()
+        super(QueuedJsonRpcStreamWriter, self).close()
+
+    def write_frame(self, frame):
+        if self._closed:
+            log.warning("Dropped a message written after the writer was closed")
+            return
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            started = time.monotonic()
+            while True:
+                try:
+                    self._queue.put(frame, timeout=0.1)
+                    break
+                except queue.Full:
+                    # nothing drains the queue once the writer thread is gone
+                    if self._closed and not self._thread.is_alive():
+                        log.warning("Dropped a message written after the writer was closed")
+                        return
+            self.stats.blocked_writes += 1
+            self.stats.blocked_time += time.monotonic() - started
+        depth = self._queue.qsize()
+        if depth > self.stats.max_depth:
+            self.stats.max_depth = depth
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def _drain(self):
+        closing = False
+        while not closing:
+            frame = self._queue.get()
+            if frame is self._CLOSE:
+                break
+            batch = [frame]
+            deadline = time.monotonic() + self._max_latency
+            while len(batch) < self._max_batch:
+                try:
+                    timeout = deadline - time.monotonic()
+                    if timeout > 0:
+                        frame = self._queue.get(timeout=timeout)
+                    else:
+                        frame = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if frame is self._CLOSE:
+                    closing = True
+                    break
+                batch.append(frame)
+            self._send(batch)
+
+    def _send(self, batch):
+        data = b''.join(batch)
+        with self._wfile_lock:
+            if self._wfile.closed:
+                return
+            try:
+                self._wfile.write(data)
                 self._wfile.flush()
-            except Exception:  # pylint: disable=broad-except   
-                log.exception("Failed to write message to output file %s", message)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Failed to write %d messages to output file", len(batch))
+                return
+        self.stats.messages += len(batch)
+        self.stats.batches += 1
+        self.stats.bytes += len(data)
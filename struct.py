@@ -1,5 +1,5 @@
-from typing import Optional, List
-from .dpylsp import LspItem
+from typing import Optional, List, Union
+from .dpylsp import LspItem, SlottedLspItem
 from . import constant as ct
 
 
@@ -11,13 +11,17 @@ EOL: List[str] = ['\n', '\r\n', '\r']
 DocumentUri = str
 
 
-class Position(LspItem):
+class Position(SlottedLspItem):
+    __slots__ = ('line', 'character')
+
     def __init__(self, line: int, character: int, **kwargs):
         self.line: int = line
         self.character: int = character
 
 
-class Range(LspItem):
+class Range(SlottedLspItem):
+    __slots__ = ('start', 'end')
+
     def __init__(self, start: Position, end: Position, **kwargs):
         self.start = start
         self.end = end
@@ -28,7 +32,9 @@ class Range(LspItem):
                    end=Position.fromDict(param['end']))
 
 
-class Location(LspItem):
+class Location(SlottedLspItem):
+    __slots__ = ('uri', 'range')
+
     def __init__(self, uri: DocumentUri, range: Range, **kwargs):
         self.uri = uri
         self.range = range
@@ -38,12 +44,16 @@ class Location(LspItem):
         return cls(uri=param['uri'], range=Range.fromDict(param['range']))
 
 
-class TextDocumentIdentifier(LspItem):
+class TextDocumentIdentifier(SlottedLspItem):
+    __slots__ = ('uri',)
+
     def __init__(self, uri: DocumentUri, **kwargs):
         self.uri = uri
 
 
 class VersionedTextDocumentIdentifier(TextDocumentIdentifier):
+    __slots__ = ('version',)
+
     def __init__(self,
                  uri: DocumentUri,
                  version: Optional[int] = None,
@@ -52,10 +62,12 @@ class VersionedTextDocumentIdentifier(TextDocumentIdentifier):
         self.version: Optional[int] = version
 
 
-class TextEdit(LspItem):
+class TextEdit(SlottedLspItem):
     '''
         A textual edit applicable to a text document.
     '''
+    __slots__ = ('range', 'newText')
+
     def __init__(self, range: Range, newText: str, **kwargs):
         self.range = range
         self.newText = newText
@@ -103,19 +115,22 @@ class TextDocumentItem(LspItem):
         self.text = text
 
 
-class TextDocumentContentChangeEvent(LspItem):
+class TextDocumentContentChangeEvent(SlottedLspItem):
     '''
         An event describing a change to a text document. If range and
         rangeLength are ommitted. the new text is considered to be the full
         content of the document.
     '''
-    def __init__(self, text: str, range: Range, **kwargs):
+    __slots__ = ('text', 'range')
+
+    def __init__(self, text: str, range: Optional[Range] = None, **kwargs):
         self.text = text
         self.range = range
 
     @classmethod
     def fromDict(cls, param: dict):
-        return cls(param['text'], Range.fromDict(param['range']))
+        range = Range.fromDict(param['range']) if 'range' in param else None
+        return cls(param['text'], range)
 
 
 
@@ -123,20 +138,50 @@ class TextDocumentContentChangeEvent(LspItem):
 '''
     Diagnostic Related
 '''
-class Diagnostic(LspItem):
+class DiagnosticRelatedInformation(LspItem):
+    def __init__(self, location: Location, message: str, **kwargs):
+        self.location = location
+        self.message = message
+
+    @classmethod
+    def fromDict(cls, param: dict):
+        return cls(Location.fromDict(param['location']), param['message'])
+
+
+class Diagnostic(SlottedLspItem):
+    __slots__ = ('range', 'message', 'severity', 'code', 'codeDescription', 'source', 'tags',
+                 'relatedInformation', 'data')
+
     def __init__(self,
                  range: Range,
                  message: str,
                  severity: Optional[ct.DiagnosticSeverity] = None,
+                 code: Optional[Union[int, str]] = None,
+                 codeDescription: Optional[dict] = None,
+                 source: Optional[str] = None,
+                 tags: Optional[List[ct.DiagnosticTag]] = None,
+                 relatedInformation: Optional[List[DiagnosticRelatedInformation]] = None,
+                 data=None,
                  **kwargs):
         self.range = range
         self.message = message
         self.severity = severity
+        self.code = code
+        self.codeDescription = codeDescription
+        self.source = source
+        self.tags = tags
+        self.relatedInformation = relatedInformation
+        self.data = data
 
     @classmethod
     def fromDict(cls, param: dict):
+        related = param.get('relatedInformation')
         return Diagnostic(Range.fromDict(param['range']), param['message'],
-                          param['severity'])
+                          param['severity'], param.get('code'), param.get('codeDescription'),
+                          param.get('source'), param.get('tags'),
+                          None if related is None else
+                          [DiagnosticRelatedInformation.fromDict(item) for item in related],
+                          param.get('data'))
 
 
 
@@ -190,6 +235,14 @@ class FileSystemWatcher(LspItem):
         self.kind = kind
 
 
+class FileEvent(SlottedLspItem):
+    __slots__ = ('uri', 'type')
+
+    def __init__(self, uri: DocumentUri, type: int, **kwargs):
+        self.uri = uri
+        self.type = type  # FileChangeType
+
+
 '''
     Capability Related
 '''
@@ -0,0 +1,142 @@
+'''
+    Per method timings and sizes of the JSON-RPC traffic.
+
+    ServerManager(telemetry=True) records, for every method:
+        queue_wait  from dispatch until a worker picks the message up (us)
+        decode      parsing the JSON body (us)
+        handler     running the handler, param decoding included (us)
+        encode      encoding what the server sends for it (us)
+        bytes_in, bytes_out
+
+    into Histograms, served by the $/dpylsp/stats request and optionally
+    logged every telemetry_interval seconds. Disabled, ServerManager keeps
+    telemetry None and every probe is a single attribute check.
+'''
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    '''
+        HDR-style histogram of non negative integers: values below
+        2 ** sub_bits are exact, larger ones fall in buckets of a relative
+        width of 2 ** (1 - sub_bits), so recording is O(1) and the memory
+        only grows with the logarithm of the range.
+    '''
+    def __init__(self, sub_bits=6):
+        self._sub_bits = sub_bits
+        self._sub_count = 1 << sub_bits
+        self._half = self._sub_count >> 1
+        self._counts = defaultdict(int)  # bucket index -> count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value: int) -> int:
+        if value < self._sub_count:
+            return value
+        shift = value.bit_length() - self._sub_bits
+        return self._sub_count + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _lowest(self, index: int) -> int:
+        ''' the smallest value of bucket index '''
+        if index < self._sub_count:
+            return index
+        shift, offset = divmod(index - self._sub_count, self._half)
+        return (offset + self._half) << (shift + 1)
+
+    def record(self, value):
+        value = max(int(value), 0)
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent: float) -> int:
+        '''
+            a value at least percent of the recorded ones do not exceed,
+            within the precision of the buckets
+        '''
+        if not self.count:
+            return 0
+        rank = percent / 100 * self.count
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                # the upper end of the bucket, capped by the real maximum
+                return min(self._lowest(index + 1) - 1, self.max)
+        return self.max
+
+    def getDict(self):
+        return {
+            'count': self.count,
+            'min': self.min or 0,
+            'mean': self.total / self.count if self.count else 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': self.max or 0,
+        }
+
+
+class Telemetry:
+    def __init__(self, sub_bits=6):
+        self._sub_bits = sub_bits
+        self._lock = threading.Lock()
+        self._methods: Dict[str, Dict[str, Histogram]] = {}
+        self._dumper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def record(self, method: str, metric: str, value):
+        with self._lock:
+            metrics = self._methods.get(method)
+            if metrics is None:
+                metrics = self._methods[method] = {}
+            histogram = metrics.get(metric)
+            if histogram is None:
+                histogram = metrics[metric] = Histogram(self._sub_bits)
+            histogram.record(value)
+
+    def record_time(self, method: str, metric: str, seconds: float):
+        self.record(method, metric, seconds * 1e6)
+
+    def getDict(self) -> dict:
+        with self._lock:
+            return {method: {metric: histogram.getDict()
+                             for metric, histogram in metrics.items()}
+                    for method, metrics in self._methods.items()}
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+
+    def start_dump(self, interval: float):
+        '''
+            log the histograms every interval seconds until close()
+        '''
+        if self._dumper is not None:
+            return
+        self._dumper = threading.Thread(target=self._dump, args=(interval,),
+                                        name='telemetry-dump', daemon=True)
+        self._dumper.start()
+
+    def close(self):
+        self._stop.set()
+
+    def _dump(self, interval: float):
+        while not self._stop.wait(interval):
+            for method, metrics in sorted(self.getDict().items()):
+                summary = ', '.join(
+                    f"{metric} n={stats['count']} p50={stats['p50']} p99={stats['p99']} "
+                    f"max={stats['max']}" for metric, stats in metrics.items())
+                logger.info(f'{method}: {summary}')
@@ -0,0 +1,47 @@
+import json
+import os
+import threading
+
+from ..languageserver import LanguageServer
+
+
+class Client:
+    ''' a LanguageServer on os pipes, served on a thread '''
+    def __init__(self, server_type=LanguageServer, **kwargs):
+        c2s_r, c2s_w = os.pipe()
+        s2c_r, s2c_w = os.pipe()
+        self.server = server_type(os.fdopen(c2s_r, 'rb'), os.fdopen(s2c_w, 'wb'), **kwargs)
+        self.thread = threading.Thread(target=self.server.start, daemon=True)
+        self.thread.start()
+        self._out = os.fdopen(c2s_w, 'wb')
+        self._in = os.fdopen(s2c_r, 'rb')
+
+    def send(self, message):
+        body = json.dumps(message).encode()
+        self._out.write(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+        self._out.flush()
+
+    def receive(self):
+        headers = {}
+        while True:
+            line = self._in.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            headers[name.strip()] = value.strip()
+        return json.loads(self._in.read(int(headers['Content-Length'])))
+
+    def close(self):
+        self._out.close()
+        self._in.close()
+
+    def stop(self):
+        ''' shutdown and exit the server, then close the pipes '''
+        try:
+            self.send({'jsonrpc': '2.0', 'id': 'shutdown', 'method': 'shutdown'})
+            while self.receive().get('id') != 'shutdown':
+                pass
+            self.send({'jsonrpc': '2.0', 'method': 'exit'})
+            self.thread.join(5)
+        finally:
+            self.close()
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+from ..languageserver import LanguageServer
+
+
+class Server(LanguageServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.order = []
+        self.running = {}
+        self.peak = {}
+        self._lock = threading.Lock()
+
+    def _enter(self, key):
+        with self._lock:
+            self.running[key] = self.running.get(key, 0) + 1
+            self.peak[key] = max(self.peak.get(key, 0), self.running[key])
+
+    def _leave(self, key, n):
+        with self._lock:
+            self.running[key] -= 1
+            self.order.append((key, n))
+
+    def onDidChangeConfiguration(self, param, **kwargs):
+        self._enter('configuration')
+        time.sleep(0.02)
+        self._leave('configuration', param.settings['n'])
+
+    async def onDidChangeWatchedFiles(self, param, **kwargs):
+        self._enter('watched')
+        await asyncio.sleep(0.02)
+        self._leave('watched', len(param.changes) - 1)
+
+
+def test_keyed_methods_run_one_at_a_time_in_order(tmp_path):
+    path = str(tmp_path / 'lsp.sock')
+    server = Server(None, None, use_asyncio=True, transport='unix', path=path)
+    thread = threading.Thread(target=server.start, daemon=True)
+    thread.start()
+    client = socket.socket(socket.AF_UNIX)
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            client.connect(path)
+            break
+        except OSError:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    received = client.makefile('rb')
+
+    def send(message):
+        body = json.dumps(message).encode()
+        client.sendall(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+
+    def receive():
+        length = int(received.readline().split(b':')[1])
+        while received.readline().strip():
+            pass
+        return json.loads(received.read(length))
+
+    try:
+        for n in range(5):
+            send({'jsonrpc': '2.0', 'method': 'workspace/didChangeConfiguration',
+                  'params': {'settings': {'n': n}}})
+            send({'jsonrpc': '2.0', 'method': 'workspace/didChangeWatchedFiles',
+                  'params': {'changes': [{'uri': 'file:///x', 'type': 1}] * (n + 1)}})
+        deadline = time.monotonic() + 5
+        while len(server.order) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # concurrency=1 for both, each in the order received
+        assert server.peak == {'configuration': 1, 'watched': 1}
+        for key in ('configuration', 'watched'):
+            assert [n for name, n in server.order if name == key] == list(range(5))
+        send({'jsonrpc': '2.0', 'id': 1, 'method': 'shutdown'})
+        assert receive()['id'] == 1
+        send({'jsonrpc': '2.0', 'method': 'exit'})
+        thread.join(5)
+        assert not thread.is_alive()
+        assert not server.manager._limits
+    finally:
+        received.close()
+        client.close()
@@ -0,0 +1,108 @@
+import threading
+
+from .. import constant as ct
+from .. import param as p
+from ..languageserver import LanguageServer
+from ..methodMap import Rq_Map
+from .client import Client
+
+
+class SlowServer(LanguageServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.ran = 0
+
+    def onSlow(self, param, token=None, **kwargs):
+        self.ran += 1
+        self.started.set()
+        self.release.wait(5)  # finishes even when cancelled, like a handler ignoring its token
+        return {'done': True}
+
+    def onPolling(self, param, token=None, **kwargs):
+        self.started.set()
+        while not self.release.wait(0.01):
+            token.raise_if_cancelled()
+        return {'done': True}
+
+
+def _client():
+    client = Client(SlowServer, max_workers=1)
+    client.server.manager.register_method('test/slow', Rq_Map('onSlow', p.NullParams))
+    client.server.manager.register_method('test/polling', Rq_Map('onPolling', p.NullParams))
+    return client
+
+
+def _request(id, method='test/slow'):
+    return {'jsonrpc': '2.0', 'id': id, 'method': method, 'params': {}}
+
+
+def _cancel(id):
+    return {'jsonrpc': '2.0', 'method': '$/cancelRequest', 'params': {'id': id}}
+
+
+def _cancelled(response):
+    return response.get('error', {}).get('code') == ct.ErrorCodes.REQUESTCANCELLED
+
+
+def test_cancelled_requests_are_answered_at_once_and_never_run():
+    client = _client()
+    server = client.server
+    try:
+        for id in (1, 2, 3):
+            client.send(_request(id))
+        assert server.started.wait(5)
+        # 1 holds the only worker, 2 and 3 are queued behind it
+        client.send(_cancel(3))
+        client.send(_cancel(2))
+        responses = [client.receive(), client.receive()]
+        assert [response['id'] for response in responses] == [3, 2]
+        assert all(_cancelled(response) for response in responses)
+        assert not server.release.is_set()
+        server.release.set()
+        assert client.receive() == {'jsonrpc': '2.0', 'id': 1, 'result': {'done': True}}
+        assert server.ran == 1
+    finally:
+        server.release.set()
+        client.stop()
+
+
+def test_late_result_of_a_cancelled_request_is_dropped():
+    client = _client()
+    server = client.server
+    try:
+        client.send(_request(1))
+        assert server.started.wait(5)
+        client.send(_cancel(1))
+        response = client.receive()
+        assert response['id'] == 1 and _cancelled(response)
+        server.release.set()
+        # the result 1 returns afterwards is not sent, 2 is answered next
+        client.send(_request(2))
+        assert client.receive() == {'jsonrpc': '2.0', 'id': 2, 'result': {'done': True}}
+        assert server.ran == 2
+    finally:
+        server.release.set()
+        client.stop()
+
+
+def test_running_handler_sees_its_token_cancelled():
+    client = _client()
+    server = client.server
+    try:
+        client.send(_request(1, 'test/polling'))
+        assert server.started.wait(5)
+        client.send(_cancel(1))
+        response = client.receive()
+        assert response['id'] == 1 and _cancelled(response)
+        # the only worker is free again without release being set
+        server.started.clear()
+        client.send(_request(2))
+        assert server.started.wait(5)
+        assert not server.release.is_set()
+        server.release.set()
+        assert client.receive()['id'] == 2
+    finally:
+        server.release.set()
+        client.stop()
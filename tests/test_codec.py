@@ -0,0 +1,51 @@
+import io
+import json
+
+import pytest
+
+from ..codec import available_codecs
+from ..streams import JsonRpcStreamReader, JsonRpcStreamWriter
+
+
+class _Pipe:
+    closed = False
+
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture(params=available_codecs(), ids=lambda codec: codec.name)
+def codec(request):
+    return request.param
+
+
+def test_round_trip_with_non_str_keys(codec):
+    message = {'jsonrpc': '2.0', 'id': 1,
+               'result': {'changes': {1: [{'text': 'é😀'}], 'uri': None}, 'ok': True, 'n': 1.5}}
+    expected = json.loads(json.dumps(message))
+    body = codec.dumps_bytes(message)
+    assert json.loads(body) == expected
+    assert codec.loads(body) == expected
+
+
+def test_dumps_keeps_json_dumps_arguments(codec):
+    message = {'b': 1, 'a': {2: 'é'}}
+    body = codec.dumps_bytes(message, sort_keys=True).decode('utf-8')
+    assert json.loads(body) == {'b': 1, 'a': {'2': 'é'}}
+    assert body.index('"a"') < body.index('"b"')
+    assert '\n  "b": 1' in codec.dumps_bytes(message, indent=2).decode('utf-8')
+    assert codec.dumps_bytes(message, separators=(',', ':'), ensure_ascii=False) == \
+        json.dumps(message, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def test_writer_sends_int_keyed_results(codec):
+    pipe = _Pipe()
+    JsonRpcStreamWriter(pipe, codec).write({'jsonrpc': '2.0', 'id': 1, 'result': {3: 'x'}})
+    assert JsonRpcStreamReader(io.BytesIO(pipe.data), codec).read_message() == {
+        'jsonrpc': '2.0', 'id': 1, 'result': {'3': 'x'}}
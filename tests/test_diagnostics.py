@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from ..diagnostics import DiagnosticsScheduler
+from ..struct import Diagnostic, Position, Range
+
+
+def _diagnostics(message):
+    def compute(token):
+        return [Diagnostic(Range(Position(0, 0), Position(0, 1)), message, 1)]
+    return compute
+
+
+@pytest.fixture
+def published():
+    return []
+
+
+@pytest.fixture
+def scheduler(published):
+    scheduler = DiagnosticsScheduler(published.append, delay=0.05)
+    yield scheduler
+    scheduler.close()
+
+
+def _wait(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def _messages(published):
+    return [(params.uri, params.version, [d.message for d in params.diagnostics])
+            for params in published]
+
+
+def test_only_the_last_version_of_a_burst_is_computed(scheduler, published):
+    computed = []
+    for version in range(5):
+        def compute(token, version=version):
+            computed.append(version)
+            return _diagnostics(f'v{version}')(token)
+        scheduler.schedule('file:///a.py', compute, version)
+    assert _wait(lambda: published)
+    time.sleep(0.1)
+    assert computed == [4]
+    assert _messages(published) == [('file:///a.py', 4, ['v4'])]
+    assert scheduler.stats['superseded'] == 4
+
+
+def test_a_newer_version_cancels_the_running_computation(scheduler, published):
+    running = threading.Event()
+
+    def slow(token):
+        running.set()
+        for _ in range(500):
+            time.sleep(0.01)
+            token.raise_if_cancelled()
+        return _diagnostics('slow')(token)
+
+    scheduler.schedule('file:///a.py', slow, 1)
+    assert running.wait(5)
+    scheduler.schedule('file:///a.py', _diagnostics('fast'), 2)
+    assert _wait(lambda: published)
+    time.sleep(0.1)
+    assert _messages(published) == [('file:///a.py', 2, ['fast'])]
+    assert scheduler.stats['superseded'] == 1
+
+
+def test_unchanged_diagnostics_are_published_once(scheduler, published):
+    scheduler.schedule('file:///a.py', _diagnostics('same'), 1)
+    assert _wait(lambda: published)
+    scheduler.schedule('file:///a.py', _diagnostics('same'), 2)
+    assert _wait(lambda: scheduler.stats['unchanged'] == 1)
+    scheduler.schedule('file:///a.py', _diagnostics('other'), 3)
+    assert _wait(lambda: len(published) == 2)
+    assert [version for _, version, _ in _messages(published)] == [1, 3]
+
+
+def test_forget_drops_pending_work_and_the_last_digest(scheduler, published):
+    scheduler.schedule('file:///a.py', _diagnostics('same'), 1)
+    assert _wait(lambda: published)
+    scheduler.schedule('file:///a.py', _diagnostics('never'), 2)
+    scheduler.forget('file:///a.py')
+    time.sleep(0.15)
+    assert len(published) == 1
+    # published again after reopening, the client cleared it on close
+    scheduler.schedule('file:///a.py', _diagnostics('same'), 3)
+    assert _wait(lambda: len(published) == 2)
+
+
+def test_spellings_of_one_uri_share_their_state(scheduler, published):
+    scheduler.schedule('file:///C%3A/a%20b.py', _diagnostics('one'), 1)
+    scheduler.schedule('file:///c:/a b.py', _diagnostics('two'), 2)
+    assert _wait(lambda: published)
+    time.sleep(0.1)
+    assert _messages(published) == [('file:///c:/a b.py', 2, ['two'])]
+
+    scheduler.schedule('file:///c%3A/a%20b.py', _diagnostics('two'), 3)
+    assert _wait(lambda: scheduler.stats['unchanged'] == 1)
+    scheduler.forget('file:///C:/a%20b.py')
+    scheduler.schedule('file:///c:/a b.py', _diagnostics('two'), 4)
+    assert _wait(lambda: len(published) == 2)
@@ -0,0 +1,77 @@
+import json
+from types import MappingProxyType
+
+from ..capability import ServerCapabilities
+from ..dpylsp import LspItem, SlottedLspItem
+from ..response import InitializeResult
+from ..struct import Diagnostic, Position, Range, TextEdit
+
+
+def test_lsp_item_keeps_its_dict():
+    item = LspItem(label='x', edits=[TextEdit(Range(Position(0, 0), Position(0, 1)), 'y')])
+    assert item.getDict() == {
+        'label': 'x',
+        'edits': [{'range': {'start': {'line': 0, 'character': 0},
+                             'end': {'line': 0, 'character': 1}},
+                   'newText': 'y'}],
+    }
+
+    class Item(LspItem):
+        def __init__(self, name):
+            self.name = name
+
+    item = Item('a')
+    item.extra = 1
+    assert item.getDict() == {'name': 'a', 'extra': 1}
+    assert not hasattr(Position(0, 0), '__dict__')
+    assert isinstance(Position(0, 0), SlottedLspItem)
+
+
+def test_frozen_views_round_trip():
+    raw = {
+        'textDocumentSync': {'openClose': True, 'change': 2},
+        'workspace': {'workspaceFolders': {'supported': True}},
+        'executeCommandProvider': {'commands': ['a', 'b']},
+    }
+    capability = ServerCapabilities(**json.loads(json.dumps(raw)))
+    sync = capability.__get__('textDocumentSync')
+    commands = capability.__get__('executeCommandProvider.commands')
+    assert isinstance(sync, MappingProxyType) and isinstance(commands, tuple)
+
+    merged = capability.merged({'completionProvider': {'triggerCharacters': commands}})
+    assert json.loads(json.dumps(merged.getDict())) == {
+        **raw, 'completionProvider': {'triggerCharacters': ['a', 'b']}}
+    assert capability.getDict() == raw
+
+    result = InitializeResult(ServerCapabilities(textDocumentSync=sync))
+    result.extra = LspItem(commands=commands, sync=sync)
+    assert json.loads(json.dumps(result.getDict())) == {
+        'capabilities': {'textDocumentSync': raw['textDocumentSync']},
+        'extra': {'commands': ['a', 'b'], 'sync': raw['textDocumentSync']},
+    }
+
+
+def test_diagnostic_keeps_every_field():
+    location = {'uri': 'file:///a.py',
+                'range': {'start': {'line': 1, 'character': 0}, 'end': {'line': 1, 'character': 3}}}
+    raw = {
+        'range': {'start': {'line': 0, 'character': 0}, 'end': {'line': 0, 'character': 1}},
+        'message': 'unused', 'severity': 2, 'code': 'W0611',
+        'codeDescription': {'href': 'https://example.com/W0611'}, 'source': 'lint',
+        'tags': [1], 'relatedInformation': [{'location': location, 'message': 'here'}],
+        'data': {'fix': 1},
+    }
+    assert Diagnostic.fromDict(raw).getDict() == raw
+    diagnostic = Diagnostic(Range(Position(0, 0), Position(0, 1)), 'unused')
+    diagnostic.source = 'lint'
+    assert diagnostic.getDict()['source'] == 'lint'
+
+
+def test_get_dict_cannot_desync_the_index():
+    capability = ServerCapabilities(textDocumentSync={'change': 2}, hoverProvider=True)
+    dumped = capability.getDict()
+    dumped['textDocumentSync']['change'] = 1
+    del dumped['hoverProvider']
+    assert capability.__get__('textDocumentSync.change') == 2
+    assert 'hoverProvider' in capability
+    assert capability.getDict() == {'textDocumentSync': {'change': 2}, 'hoverProvider': True}
@@ -0,0 +1,72 @@
+import os
+import threading
+
+import pytest
+
+from ..constant import FileChangeType
+from ..fileindex import WorkspaceFileIndex
+from ..struct import FileEvent, WorkspaceFolder
+from ..uri import fsPathToUri
+
+
+def _folder(path):
+    return WorkspaceFolder(fsPathToUri(str(path)), os.path.basename(path))
+
+
+@pytest.mark.parametrize('inner_first', [False, True])
+def test_nested_folders_own_their_files(tmp_path, inner_first):
+    inner = tmp_path / 'libs' / 'inner'
+    for name in ('a.py', 'libs/b.py', 'libs/inner/c.py', 'libs/inner/deep/d.py'):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+    index = WorkspaceFileIndex(('**/*.py',))
+    for folder in ((inner, tmp_path) if inner_first else (tmp_path, inner)):
+        index.addFolder(_folder(folder))
+        assert index.wait(5)
+    c = str(inner / 'c.py')
+    assert len(index) == 4
+    assert index.byName('c.py') == [c]
+    assert len(index.underPath(str(tmp_path))) == 4
+
+    index.applyChanges([FileEvent(fsPathToUri(c), FileChangeType.DELETED)])
+    assert c not in index
+    assert c not in index.underPath(str(tmp_path))
+
+    index.applyChanges([FileEvent(fsPathToUri(c), FileChangeType.CREATED)])
+    index.removeFolder(_folder(inner))
+    assert index.byName('c.py') == [c]
+    assert len(index) == 4
+    index.close()
+
+
+def test_lookups_do_not_wait_for_a_walk(tmp_path):
+    (tmp_path / 'a.py').touch()
+    index = WorkspaceFileIndex(('**/*.py',))
+    index.addFolder(_folder(tmp_path))
+    assert index.wait(5)
+    for name in ('new/b.py', 'new/sub/c.py'):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+
+    listing, release = threading.Event(), threading.Event()
+    listdir = index._listdir
+
+    def slow_listdir(*args):
+        listing.set()
+        release.wait(5)
+        return listdir(*args)
+
+    index._listdir = slow_listdir
+    event = FileEvent(fsPathToUri(str(tmp_path / 'new')), FileChangeType.CREATED)
+    walker = threading.Thread(target=index.applyChanges, args=([event],))
+    walker.start()
+    try:
+        assert listing.wait(5)
+        assert index.byName('a.py') == [str(tmp_path / 'a.py')]
+        assert len(index) == 1
+    finally:
+        release.set()
+        walker.join(5)
+    assert sorted(index.byExtension('.py')) == sorted(
+        str(tmp_path / name) for name in ('a.py', 'new/b.py', 'new/sub/c.py'))
+    index.close()
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from ..languageserver import LanguageServer
+from .client import Client
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_exit_stops_with_the_pipe_still_open(pipelined):
+    client = Client(pipelined=pipelined)
+    try:
+        client.send({'jsonrpc': '2.0', 'id': 1, 'method': 'shutdown'})
+        assert client.receive()['id'] == 1
+        client.send({'jsonrpc': '2.0', 'method': 'exit'})
+        client.thread.join(5)
+        assert not client.thread.is_alive()
+    finally:
+        client.close()
+
+
+def test_edits_to_one_document_stay_ordered_across_spellings():
+    seen, running, lock = [], [0, 0], threading.Lock()
+
+    class Server(LanguageServer):
+        def onDidChangeTextDocument(self, param, **kwargs):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            seen.append(param.textDocument.version)
+            with lock:
+                running[0] -= 1
+
+    client = Client(Server, editor_workers=2)
+    try:
+        for version in range(1, 7):
+            uri = 'file:///C%3A/x.py' if version % 2 else 'file:///c:/x.py'
+            client.send({'jsonrpc': '2.0', 'method': 'textDocument/didChange', 'params': {
+                'textDocument': {'uri': uri, 'version': version}, 'contentChanges': []}})
+        client.send({'jsonrpc': '2.0', 'id': 1, 'method': 'shutdown'})
+        client.receive()
+        deadline = time.monotonic() + 5
+        while len(seen) < 6 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert seen == list(range(1, 7))
+        assert running[1] == 1
+    finally:
+        client.send({'jsonrpc': '2.0', 'method': 'exit'})
+        client.thread.join(5)
+        client.close()
@@ -0,0 +1,68 @@
+import io
+import json
+import threading
+
+from ..pipeline import ReaderPipeline
+from ..streams import JsonRpcStreamReader
+
+
+def _frames(messages):
+    out = b''
+    for message in messages:
+        body = json.dumps(message).encode()
+        out += b'Content-Length: %d\r\n\r\n' % len(body) + body
+    return out
+
+
+def test_messages_are_dispatched_in_order():
+    messages = [{'jsonrpc': '2.0', 'method': 'm', 'params': {'n': n}} for n in range(500)]
+    data = _frames(messages[:250]) + b'Content-Length: 3\r\n\r\n{{{' + _frames(messages[250:])
+    pipeline = ReaderPipeline(JsonRpcStreamReader(io.BytesIO(data)), max_frames=4, max_messages=4)
+    dispatched = []
+    pipeline.run(dispatched.append)
+    assert dispatched == messages  # the broken body is dropped, the rest goes on
+    stats = pipeline.getDict()
+    assert stats['read']['items'] == 501
+    assert stats['decode']['items'] == stats['dispatch']['items'] == 500
+
+
+class BlockingReader:
+    ''' one message, then a read that only returns when released '''
+    def __init__(self):
+        self.release = threading.Event()
+        self.closed = threading.Event()
+        self._bodies = [json.dumps({'jsonrpc': '2.0', 'method': 'exit'}).encode()]
+
+    def read_frame(self):
+        if self._bodies:
+            return self._bodies.pop()
+        self.release.wait(5)
+        return None
+
+    def decode(self, frame):
+        return json.loads(frame)
+
+    def close(self):
+        self.closed.set()
+
+
+def test_stop_returns_while_the_reader_is_blocked():
+    reader = BlockingReader()
+    pipeline = ReaderPipeline(reader)
+    runner = threading.Thread(target=pipeline.run, args=(lambda message: pipeline.stop(),))
+    runner.start()
+    runner.join(5)
+    assert not runner.is_alive()
+    # the reader thread closes the reader once its read returns
+    assert not reader.closed.is_set()
+    reader.release.set()
+    assert reader.closed.wait(5)
+
+
+def test_stop_closes_a_finished_reader():
+    reader = BlockingReader()
+    reader.release.set()
+    pipeline = ReaderPipeline(reader)
+    pipeline.run(lambda message: None)
+    pipeline.stop()
+    assert reader.closed.wait(5)
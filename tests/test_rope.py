@@ -0,0 +1,112 @@
+import bisect
+import random
+import re
+
+import pytest
+
+from .. import constant as ct
+from .. import rope
+from ..rope import Rope
+from ..struct import Position
+from ..workspace import Document, columnToIndex, indexToColumn
+
+_BREAK = re.compile(r'\r\n|\r|\n')
+
+
+def _starts(text):
+    return [0] + [match.end() for match in _BREAK.finditer(text)]
+
+
+def _assert_matches(tree: Rope, text: str):
+    assert len(tree) == len(text)
+    assert tree.text == text
+    assert tree.isascii() == text.isascii()
+    starts = _starts(text)
+    assert tree.line_count == len(starts)
+    for line in range(-1, len(starts) + 2):
+        expected = len(text) if line >= len(starts) else starts[max(line, 0)]
+        assert tree.line_start(line) == expected, (text, line)
+    for offset in range(-1, len(text) + 2):
+        expected = bisect.bisect_right(starts, min(max(offset, 0), len(text))) - 1
+        assert tree.line_of(offset) == expected, (text, offset)
+
+
+@pytest.fixture
+def small_leaves(monkeypatch):
+    # many leaves, so '\r\n' pairs straddle leaves and nodes
+    monkeypatch.setattr(rope, 'LEAF_SIZE', 2)
+    monkeypatch.setattr(rope, 'LEAF_MAX', 4)
+
+
+@pytest.mark.parametrize('text', ['', 'a', '\n', '\r\n', '\r', 'a\r\nb\rc\nd',
+                                  '\r\r\n\n\r', 'é😀\r\n😀'])
+def test_lines_of_a_fresh_rope(small_leaves, text):
+    _assert_matches(Rope(text), text)
+
+
+def test_splice_matches_string_edits(small_leaves):
+    rnd = random.Random('splice')
+    for _ in range(300):
+        text = ''.join(rnd.choice('ab\r\né😀') for _ in range(rnd.randrange(30)))
+        tree = Rope(text)
+        for _ in range(20):
+            start = rnd.randrange(-2, len(text) + 3)
+            end = rnd.randrange(start - 1, len(text) + 3)
+            insert = ''.join(rnd.choice('x\r\n😀') for _ in range(rnd.randrange(4)))
+            previous, previous_text = tree, text
+            tree = tree.splice(start, end, insert)
+            clamped = min(max(start, 0), len(text))
+            text = text[:clamped] + insert + text[max(end, clamped):]
+            _assert_matches(tree, text)
+            # persistent, the old version is untouched
+            assert previous.text == previous_text
+        for _ in range(10):
+            start, end = sorted(rnd.randrange(-2, len(text) + 3) for _ in range(2))
+            assert tree.slice(start, end) == text[max(start, 0):max(end, 0)]
+
+
+def test_splice_makes_and_breaks_crlf(small_leaves):
+    tree = Rope('a\rb\nc')
+    assert tree.line_count == 3
+    joined = tree.splice(2, 3, '')  # 'a\r\nc'
+    assert joined.line_count == 2 and joined.line_start(1) == 3
+    split = joined.splice(2, 2, 'x')  # 'a\rx\nc'
+    assert split.line_count == 3 and split.line_of(3) == 1
+
+
+_LINE = 'aé😀b'
+_COLUMNS = {
+    # index of each character, then its column in each encoding
+    ct.PositionEncodingKind.UTF8: [0, 1, 3, 7, 8],
+    ct.PositionEncodingKind.UTF16: [0, 1, 2, 4, 5],
+    ct.PositionEncodingKind.UTF32: [0, 1, 2, 3, 4],
+}
+
+
+@pytest.mark.parametrize('encoding', list(ct.PositionEncodingKind))
+def test_column_conversion(encoding):
+    columns = _COLUMNS[encoding]
+    for index, column in enumerate(columns):
+        assert indexToColumn(_LINE, index, encoding) == column
+        assert columnToIndex(_LINE, column, encoding) == index
+    # inside a character points before it, past the end is clamped
+    for index in range(len(columns) - 1):
+        for column in range(columns[index] + 1, columns[index + 1]):
+            assert columnToIndex(_LINE, column, encoding) == index
+    assert columnToIndex(_LINE, columns[-1] + 5, encoding) == len(_LINE)
+    assert columnToIndex('abc', 2, encoding) == 2
+
+
+@pytest.mark.parametrize('encoding', list(ct.PositionEncodingKind))
+def test_document_positions_round_trip(encoding):
+    document = Document('file:///a.py', 'x\r\n' + _LINE + '\rend', encoding)
+    columns = _COLUMNS[encoding]
+    for index, column in enumerate(columns):
+        offset = document.offset_at(Position(1, column))
+        assert offset == 3 + index
+        position = document.position_at(offset)
+        assert (position.line, position.character) == (1, column)
+    # clamped to the end of the line, before its line break
+    assert document.offset_at(Position(1, 99)) == 3 + len(_LINE)
+    assert document.offset_at(Position(0, 99)) == 1
+    assert document.offset_at(Position(9, 0)) == len(document.text)
@@ -0,0 +1,96 @@
+import threading
+import time
+
+from ..methodMap import Priority
+from ..worker import PriorityTaskQueue, Worker
+
+
+class Tracker:
+    ''' records the order tasks run in and how many ran at once, per key '''
+    def __init__(self):
+        self.order = []
+        self.running = {}
+        self.peak = {}
+        self._lock = threading.Lock()
+
+    def task(self, key, name, seconds=0.02):
+        with self._lock:
+            self.running[key] = self.running.get(key, 0) + 1
+            self.peak[key] = max(self.peak.get(key, 0), self.running[key])
+        time.sleep(seconds)
+        with self._lock:
+            self.running[key] -= 1
+            self.order.append(name)
+
+
+def test_keyed_tasks_respect_their_limit():
+    tracker = Tracker()
+    worker = Worker('test', count=4)
+    worker.start()
+    try:
+        for i in range(6):
+            worker.assign_keyed('serial', 1, tracker.task, 'serial', ('serial', i))
+            worker.assign_keyed('pair', 2, tracker.task, 'pair', ('pair', i))
+    finally:
+        worker.close()
+    assert tracker.peak == {'serial': 1, 'pair': 2}
+    assert [i for key, i in tracker.order if key == 'serial'] == list(range(6))
+
+
+def test_different_keys_run_in_parallel():
+    tracker = Tracker()
+    worker = Worker('test', count=2)
+    both = threading.Barrier(2, timeout=5)
+
+    def meet(key):
+        both.wait()  # breaks unless both keys run at the same time
+        tracker.task(key, key, 0)
+
+    worker.start()
+    try:
+        worker.assign_keyed('a', 1, meet, 'a')
+        worker.assign_keyed('b', 1, meet, 'b')
+    finally:
+        worker.close()
+    assert sorted(tracker.order) == ['a', 'b']
+
+
+def test_queue_serves_the_lowest_priority_first():
+    tasks = PriorityTaskQueue(aging=60)
+    for name, priority in (('bg1', Priority.BACKGROUND), ('n1', Priority.NORMAL),
+                           ('i1', Priority.INTERACTIVE), ('n2', Priority.NORMAL),
+                           ('i2', Priority.INTERACTIVE)):
+        tasks.put(name, priority)
+    assert [tasks.get() for _ in range(5)] == ['i1', 'i2', 'n1', 'n2', 'bg1']
+    stats = tasks.stats[Priority.NORMAL].getDict()
+    assert stats['served'] == 2 and stats['depth'] == 0
+
+
+def test_waiting_tasks_age_into_higher_classes():
+    tasks = PriorityTaskQueue(aging=0.5)
+    now = time.monotonic()
+    # waited two aging periods, now ranks with fresh INTERACTIVE tasks
+    tasks.put('old background', Priority.BACKGROUND, now - 1.1)
+    tasks.put('interactive', Priority.INTERACTIVE)
+    assert tasks.get() == 'old background'
+    tasks.put('fresh background', Priority.BACKGROUND)
+    tasks.put('normal', Priority.NORMAL)
+    assert [tasks.get(), tasks.get(), tasks.get()] == [
+        'interactive', 'normal', 'fresh background']
+
+
+def test_worker_runs_queued_tasks_by_priority():
+    order = []
+    gate = threading.Event()
+    worker = Worker('test', count=1, aging=60)
+    worker.start()
+    try:
+        worker.assign(gate.wait, 5)  # holds the only thread while the others queue
+        for name, priority in (('background', Priority.BACKGROUND),
+                               ('normal', Priority.NORMAL),
+                               ('interactive', Priority.INTERACTIVE)):
+            worker.submit(order.append, (name,), priority=priority)
+        gate.set()
+    finally:
+        worker.close()
+    assert order == ['interactive', 'normal', 'background']
@@ -0,0 +1,167 @@
+import os
+import random
+
+import pytest
+
+from .. import constant as ct
+from ..mapped import MappedText, mapFile
+from ..rope import Rope
+from ..struct import Position, Range, TextDocumentContentChangeEvent
+from ..uri import fsPathToUri
+from ..workspace import Document, MappedDocuments, MappedSnapshot, WorkSpace
+
+_ALPHABET = 'ab \r\né😀'
+
+
+def _change(rnd: random.Random, document: Document) -> TextDocumentContentChangeEvent:
+    # positions past the ends of lines and of the document on purpose
+    def position():
+        return Position(rnd.randrange(document.lineCount + 1), rnd.randrange(6))
+    start, end = sorted((position(), position()), key=lambda p: (p.line, p.character))
+    text = ''.join(rnd.choice(_ALPHABET) for _ in range(rnd.randrange(3)))
+    return TextDocumentContentChangeEvent(text, Range(start, end))
+
+
+@pytest.mark.parametrize('encoding', list(ct.PositionEncodingKind))
+def test_update_batch_matches_one_at_a_time(encoding):
+    rnd = random.Random(f'update-{encoding.value}')
+    for _ in range(3000):
+        text = ''.join(rnd.choice(_ALPHABET) for _ in range(rnd.randrange(12)))
+        batched = Document('file:///a.py', text, encoding)
+        single = Document('file:///a.py', text, encoding)
+        changes = []
+        for _ in range(rnd.randrange(1, 5)):
+            # half of the time build runs, each change before the one before
+            reference = single if rnd.random() < 0.5 else batched
+            changes.append(_change(rnd, reference))
+            single.update(changes[-1:])
+        batched.update(changes)
+        assert batched.text == single.text, (text, [change.getDict() for change in changes])
+
+
+def _texts(seed):
+    rnd = random.Random(seed)
+    yield ''
+    yield 'plain ascii\nlines\r\nonly\r'
+    for _ in range(200):
+        yield ''.join(rnd.choice(_ALPHABET + 'xyz') for _ in range(rnd.randrange(40)))
+
+
+def _assert_same_reads(text, expected: Rope, rnd: random.Random):
+    assert len(text) == len(expected)
+    assert text.text == expected.text
+    assert text.isascii() == expected.isascii()
+    assert text.line_count == expected.line_count
+    for line in range(-1, expected.line_count + 2):
+        assert text.line_start(line) == expected.line_start(line), line
+    for offset in range(-1, len(expected) + 2):
+        assert text.line_of(offset) == expected.line_of(offset), offset
+    for _ in range(20):
+        start, end = sorted(rnd.randrange(-2, len(expected) + 3) for _ in range(2))
+        assert text.slice(start, end) == expected.slice(start, end), (start, end)
+
+
+def test_mapped_text_reads_like_a_rope(tmp_path):
+    rnd = random.Random('mapped')
+    for i, text in enumerate(_texts('mapped-texts')):
+        data = text.encode('utf-8')
+        _assert_same_reads(MappedText(data), Rope(text), rnd)
+        path = tmp_path / f'{i}.txt'
+        path.write_bytes(data)
+        with open(path, 'rb') as file:
+            mapped = mapFile(file)
+        _assert_same_reads(mapped, Rope(text), rnd)
+
+
+def _uri(path):
+    return fsPathToUri(str(path))
+
+
+def _replace(path, text):
+    ''' write text the way editors do, through a new file moved over path '''
+    new = path.with_name(path.name + '.new')
+    new.write_text(text, encoding='utf-8', newline='')
+    os.replace(new, path)
+
+
+def test_mapped_documents_follow_the_file(tmp_path):
+    path = tmp_path / 'a.py'
+    path.write_text('one\n', encoding='utf-8')
+    documents = MappedDocuments()
+    snapshot = documents.get(_uri(path))
+    assert isinstance(snapshot, MappedSnapshot) and snapshot.version is None
+    assert snapshot.text == 'one\n' and documents.isCurrent(snapshot)
+    assert documents.get(_uri(path)).stamp == snapshot.stamp
+
+    # a new size
+    _replace(path, 'one\ntwo\n')
+    assert not documents.isCurrent(snapshot)
+    assert snapshot.text == 'one\n'  # the old mapping stays readable
+    assert documents.get(_uri(path)).text == 'one\ntwo\n'
+
+    # same size and mtime, only the inode tells the files apart
+    stat = os.stat(path)
+    _replace(path, 'one\nTWO\n')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert documents.get(_uri(path)).text == 'one\nTWO\n'
+
+    # same inode and size, a new mtime
+    stat = os.stat(path)
+    with open(path, 'r+b') as file:
+        file.write(b'ONE')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert documents.get(_uri(path)).text == 'ONE\nTWO\n'
+
+
+def test_mapped_documents_drop_the_least_recently_used(tmp_path):
+    paths = [tmp_path / f'{name}.py' for name in 'abc']
+    for path in paths:
+        path.write_text(path.name, encoding='utf-8')
+    # without stat checks a mapping is reused until it is dropped
+    documents = MappedDocuments(max_open=2, check_mtime=False)
+    a, b, c = (_uri(path) for path in paths)
+    documents.get(a)
+    documents.get(b)
+    _replace(paths[0], 'new a')
+    _replace(paths[1], 'new b')
+    documents.get(a)  # a is now used more recently than b
+    documents.get(c)  # drops b
+    assert documents.get(a).text == 'a.py'
+    assert documents.get(b).text == 'new b'
+    documents.invalidate(a)
+    assert documents.get(a).text == 'new a'
+    documents.clear()
+
+
+def test_mapped_documents_raise_key_error_without_a_file(tmp_path):
+    documents = MappedDocuments()
+    with pytest.raises(KeyError):
+        documents.get(_uri(tmp_path / 'missing.py'))
+    with pytest.raises(KeyError):
+        documents.get('untitled:Untitled-1')
+    path = tmp_path / 'gone.py'
+    path.write_text('x', encoding='utf-8')
+    documents.get(_uri(path))
+    path.unlink()
+    with pytest.raises(KeyError):
+        documents.get(_uri(path))
+
+
+def test_workspace_mapped_snapshot_staleness(tmp_path):
+    path = tmp_path / 'a.py'
+    path.write_text('one\n', encoding='utf-8')
+    workspace = WorkSpace()
+    snapshot = workspace.getSnapshot(_uri(path))
+    assert isinstance(snapshot, MappedSnapshot)
+    assert workspace.getDocumentText(_uri(path)) == 'one\n'
+    assert not workspace.isStale(snapshot)
+    # opened under another spelling of its uri
+    workspace.addDocument(_uri(path).replace('/a.py', '/%61.py'), 'one\n', 1)
+    assert workspace.isStale(snapshot)
+    workspace.removeDocument(_uri(path))
+    snapshot = workspace.getSnapshot(_uri(path))
+    assert not workspace.isStale(snapshot)
+    _replace(path, 'one\ntwo\n')
+    assert workspace.isStale(snapshot)
+    with pytest.raises(KeyError):
+        workspace.getSnapshot(_uri(tmp_path / 'missing.py'))
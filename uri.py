@@ -1,10 +1,20 @@
 # https://github.com/Microsoft/vscode-uri/blob/e59cab84f5df6265aed18ae5f43552d3eef13bb9/lib/index.ts
+import functools
 import urllib.parse as parse
 import os
 import re
+import sys
+from concurrent.futures import Executor
+from typing import Iterable, List, NewType, Optional
 
 driverLetterPath = re.compile(r'^\/[a-zA-Z]:')
 
+# the conversions are pure, workspace scans and watched file events repeat them
+CACHE_SIZE = 4096
+
+# a DocumentUri in its canonical form, see normalizeUri
+NormalizedUri = NewType('NormalizedUri', str)
+
 
 def urlparse(uri: str):
     scheme, netloc, path, params, query, fragment = parse.urlparse(uri)
@@ -13,10 +23,11 @@ def urlparse(uri: str):
             parse.unquote(fragment))
 
 
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def uriTofsPath(uri: str):
     scheme, netloc, path, params, query, fragment = urlparse(uri)
     if netloc and path and scheme == 'file':
-        value = f'//{netloc}${path}'
+        value = f'//{netloc}{path}'
     elif driverLetterPath.match(path):
         value = path[1].lower() + path[2:]
     else:
@@ -28,6 +39,7 @@ def uriTofsPath(uri: str):
     return value
 
 
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def fsPathToUri(path: str):
     scheme = 'file'
     netloc = ''
@@ -55,3 +67,114 @@ def fsPathToUri(path: str):
     return parse.urlunparse(
         (parse.quote(scheme), parse.quote(netloc), quoted_path,
          parse.quote(params), parse.quote(query), parse.quote(fragment)))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def normalizeUri(uri: str) -> NormalizedUri:
+    '''
+        the key of uri: scheme and authority lower case, percent-encoding
+        redone the way fsPathToUri does it and the drive letter lower case,
+        so file:///C%3A/a%20b.py and file:///c:/a b.py give the same,
+        interned, string.
+    '''
+    scheme, netloc, path, query, fragment = parse.urlsplit(uri)
+    path = parse.unquote(path)
+    if driverLetterPath.match(path):
+        path = '/' + path[1].lower() + ':' + parse.quote(path[3:])
+    else:
+        path = parse.quote(path)
+    return sys.intern(parse.urlunsplit(
+        (scheme.lower(), parse.quote(parse.unquote(netloc).lower()), path,
+         parse.quote(parse.unquote(query), safe='=&'), parse.quote(parse.unquote(fragment)))))
+
+
+# below it a process pool costs more than it saves
+POOL_THRESHOLD = 20000
+
+
+def _slashed(path: str) -> str:
+    return path.replace('\\', '/') if os.name == 'nt' else path
+
+
+def _rootUris(roots, aliases=False):
+    '''
+        (uri prefix, path prefix) of every root, the longest first. With
+        aliases a drive letter is also spelled the other ways editors send
+        it: C:, c%3A and C%3A.
+    '''
+    prefixes = []
+    for root in roots:
+        root = _slashed(root).rstrip('/')
+        if not root:
+            continue
+        rootUri = fsPathToUri(root)
+        rootPath = _slashed(uriTofsPath(rootUri))
+        scheme, _, path = rootUri.partition(':///')
+        if aliases and driverLetterPath.match('/' + path):
+            for letter in {path[0].lower(), path[0].upper()}:
+                for colon in (':', '%3A'):
+                    prefixes.append((f'{scheme}:///{letter}{colon}{path[2:]}', rootPath))
+        else:
+            prefixes.append((rootUri, rootPath))
+    prefixes.sort(key=lambda prefix: len(prefix[1]), reverse=True)
+    return prefixes
+
+
+def _pathsToUris(paths, prefixes):
+    result = []
+    for path in paths:
+        slashed = _slashed(path)
+        for rootUri, rootPath in prefixes:
+            if slashed.startswith(rootPath) and slashed[len(rootPath):len(rootPath) + 1] in ('/', ''):
+                result.append(rootUri + parse.quote(slashed[len(rootPath):]))
+                break
+        else:
+            result.append(fsPathToUri(path))
+    return result
+
+
+def _urisTofsPaths(uris, prefixes):
+    result = []
+    for uri in uris:
+        for rootUri, rootPath in prefixes:
+            if uri.startswith(rootUri):
+                suffix = uri[len(rootUri):]
+                # anything but a plain path below the root is left to urlparse
+                if suffix[:1] in ('/', '') and '?' not in suffix and '#' not in suffix:
+                    value = rootPath + parse.unquote(suffix)
+                    result.append(value.replace('/', '\\') if os.name == 'nt' else value)
+                    break
+        else:
+            result.append(uriTofsPath(uri))
+    return result
+
+
+def _bulk(convert, items, prefixes, pool, chunk_size):
+    items = list(items)
+    if pool is None or len(items) < POOL_THRESHOLD:
+        return convert(items, prefixes)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    result = []
+    for converted in pool.map(convert, chunks, [prefixes] * len(chunks)):
+        result.extend(converted)
+    return result
+
+
+def fsPathsToUris(paths: Iterable[str], roots: Iterable[str] = (),
+                  pool: Optional[Executor] = None, chunk_size: int = 5000) -> List[str]:
+    '''
+        fsPathToUri of every path, in order. The paths below one of roots
+        (the workspace folders) only have the part after the root quoted.
+        With pool, a concurrent.futures executor, batches of at least
+        POOL_THRESHOLD paths are converted in chunks of chunk_size on it.
+    '''
+    return _bulk(_pathsToUris, paths, _rootUris(roots), pool, chunk_size)
+
+
+def urisTofsPaths(uris: Iterable[str], roots: Iterable[str] = (),
+                  pool: Optional[Executor] = None, chunk_size: int = 5000) -> List[str]:
+    '''
+        uriTofsPath of every uri, in order, the counterpart of fsPathsToUris.
+        roots are file system paths as well.
+    '''
+    return _bulk(_urisTofsPaths, uris, _rootUris(roots, aliases=True), pool, chunk_size)
@@ -1,36 +1,171 @@
 import threading
-import queue
+import time
 import logging
+from collections import deque
 
 logger = logging.getLogger(__name__)
+
+
+class ClassStats:
+    '''
+        queue statistics of one priority class
+    '''
+    def __init__(self):
+        self.depth = 0
+        self.served = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def getDict(self):
+        return {
+            'depth': self.depth,
+            'served': self.served,
+            'mean_wait': self.total_wait / self.served if self.served else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+class PriorityTaskQueue:
+    '''
+        A queue.Queue look-alike serving the lowest priority value first.
+        A waiting task moves up one class every `aging` seconds, so a
+        stream of urgent tasks cannot starve the others. Tasks of the same
+        class stay FIFO.
+    '''
+    def __init__(self, aging=0.5):
+        self._aging = aging
+        self._queues = {}  # priority -> deque of (enqueued, item)
+        self._cond = threading.Condition()
+        self._unfinished = 0
+        self.stats = {}  # priority -> ClassStats
+
+    def put(self, item, priority=0, enqueued=None):
+        with self._cond:
+            if priority not in self._queues:
+                self._queues[priority] = deque()
+                self.stats[priority] = ClassStats()
+            self._queues[priority].append((time.monotonic() if enqueued is None else enqueued,
+                                           item))
+            self.stats[priority].depth += 1
+            self._unfinished += 1
+            self._cond.notify()
+
+    def get(self):
+        with self._cond:
+            while not any(self._queues.values()):
+                self._cond.wait()
+            now = time.monotonic()
+            chosen, best = None, None
+            for priority, tasks in self._queues.items():
+                if tasks:
+                    rank = (priority - (now - tasks[0][0]) / self._aging, priority)
+                    if best is None or rank < best:
+                        chosen, best = priority, rank
+            enqueued, item = self._queues[chosen].popleft()
+            stats = self.stats[chosen]
+            stats.depth -= 1
+            if item is None:  # stop sentinel
+                return item
+            wait = now - enqueued
+            stats.served += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            return item
+
+    def task_done(self):
+        with self._cond:
+            self._unfinished -= 1
+            if self._unfinished == 0:
+                self._cond.notify_all()
+
+    def join(self):
+        with self._cond:
+            while self._unfinished:
+                self._cond.wait()
+
+    def qsize(self):
+        with self._cond:
+            return sum(len(tasks) for tasks in self._queues.values())
+
+
 class Worker:
     '''
         Producer-Consumer
+
+        Tasks are served by priority (lower first, see PriorityTaskQueue).
+        Tasks assigned with a key run at most `limit` at a time. Those over
+        the limit are held back and released in order, so limit=1 keeps the
+        tasks of one key strictly sequential while other keys run in parallel.
     '''
-    def __init__(self, name='', count=1):
-        self.q = queue.Queue()
+    def __init__(self, name='', count=1, aging=0.5):
+        self.q = PriorityTaskQueue(aging)
         self.count = count
         self.name = name
-        self.worker_list = [threading.Thread(target=self.work) for i in range(count)]
-    
+        self.worker_list = [threading.Thread(target=self.work, name=f'{name}-{i}')
+                            for i in range(count)]
+        self._keys_lock = threading.Lock()
+        self._active = {}  # key -> tasks of the key queued or running
+        self._held = {}  # key -> deque of tasks over the limit
+
     def start(self):
         for worker in self.worker_list:
             worker.start()
-    
+
     def close(self):
         self.q.join()
         for i in range(self.count):
             self.q.put(None)
         for worker in self.worker_list:
             worker.join()
-    
+
     def assign(self, func, *args, **kwargs):
-        self.q.put((func, args, kwargs))
+        self.submit(func, args, kwargs)
+
+    def assign_keyed(self, key, limit, func, *args, **kwargs):
+        self.submit(func, args, kwargs, key=key, limit=limit)
+
+    def submit(self, func, args=(), kwargs=None, key=None, limit=None,
+               priority=1):  # methodMap.Priority.NORMAL
+        task = (func, args, kwargs or {}, key, priority, time.monotonic())
+        if key is not None:
+            with self._keys_lock:
+                active = self._active.get(key, 0)
+                if active >= limit:
+                    self._held.setdefault(key, deque()).append(task)
+                    return
+                self._active[key] = active + 1
+        self.q.put(task, priority, task[5])
+
+    def stats(self):
+        return {priority: stats.getDict() for priority, stats in self.q.stats.items()}
+
+    def _release(self, key):
+        with self._keys_lock:
+            held = self._held.get(key)
+            if held:
+                # the finished task hands its slot over
+                task = held.popleft()
+                if not held:
+                    del self._held[key]
+                # held time counts as waiting
+                self.q.put(task, task[4], task[5])
+            elif self._active[key] == 1:
+                del self._active[key]
+            else:
+                self._active[key] -= 1
 
     def work(self):
         while True:
             task = self.q.get()
             if task is None:
+                self.q.task_done()
                 break
-            task[0](*task[1], **task[2])
-            self.q.task_done()
\ No newline at end of file
+            func, args, kwargs, key = task[:4]
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception(f'{self.name} worker task failed')
+            finally:
+                if key is not None:
+                    self._release(key)
+                self.q.task_done()
@@ -1,53 +1,303 @@
 # thanks https://github.com/palantir/python-language-server
-from typing import List, Dict, Optional, Union
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple, Union
 import logging
-import io
-from .struct import (TextDocumentContentChangeEvent, WorkspaceFolder, DocumentUri)
+import os
+import re
+import threading
+from .struct import (TextDocumentContentChangeEvent, WorkspaceFolder, DocumentUri,
+                     Position)
+from .rope import Rope
+from .mapped import MappedText, mapFile
+from .uri import NormalizedUri, normalizeUri, uriTofsPath
+from . import constant as ct
 
 logger = logging.getLogger(__name__)
 
+_LINE = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+\Z')
+_ASTRAL = re.compile('[\U00010000-\U0010FFFF]')
+
+
+def columnToIndex(line: str, column: int,
+                  encoding: ct.PositionEncodingKind) -> int:
+    '''
+        convert a column counted in encoding's code units into an index of
+        line. A column inside a multi-unit character points before it.
+    '''
+    if encoding == ct.PositionEncodingKind.UTF32 or line.isascii():
+        return min(column, len(line))
+    if encoding == ct.PositionEncodingKind.UTF16:
+        if not _ASTRAL.search(line):
+            return min(column, len(line))
+        return len(line.encode('utf-16-le')[:column * 2].decode(
+            'utf-16-le', 'ignore'))
+    return len(line.encode('utf-8')[:column].decode('utf-8', 'ignore'))
+
+
+def indexToColumn(line: str, index: int,
+                  encoding: ct.PositionEncodingKind) -> int:
+    '''
+        the inverse of columnToIndex
+    '''
+    if encoding == ct.PositionEncodingKind.UTF32 or line.isascii():
+        return index
+    prefix = line[:index]
+    if encoding == ct.PositionEncodingKind.UTF16:
+        return index + len(_ASTRAL.findall(prefix))
+    return len(prefix.encode('utf-8'))
+
+
+class DocumentSnapshot:
+    '''
+        An immutable view of a document at one version. Taking one is O(1)
+        and it stays valid while the document keeps changing, because the
+        rope underneath is persistent.
+    '''
+    __slots__ = ('uri', 'version', 'encoding', '_rope')
+
+    def __init__(self, uri: str, rope: Rope, version: Optional[int] = None,
+                 encoding: ct.PositionEncodingKind = ct.PositionEncodingKind.UTF16):
+        self.uri = uri
+        self.version = version
+        self.encoding = encoding
+        self._rope = rope
+
+    @property
+    def text(self) -> str:
+        return self._rope.text
+
+    @property
+    def lines(self) -> List[str]:
+        '''
+            lines with their line breaks, like str.splitlines(True) but only
+            splitting on the EOLs of the protocol
+        '''
+        return _LINE.findall(self.text)
+
+    @property
+    def lineCount(self) -> int:
+        return self._rope.line_count
+
+    def line(self, n: int) -> str:
+        '''
+            text of line n including its line break, '' if n is out of range
+        '''
+        rope = self._rope
+        if n < 0 or n >= rope.line_count:
+            return ''
+        return rope.slice(rope.line_start(n), rope.line_start(n + 1))
+
+    def _lineEnd(self, n: int) -> int:
+        ''' offset of the line break of line n (or of the end of text) '''
+        rope = self._rope
+        if n + 1 >= rope.line_count:
+            return len(rope)
+        end = rope.line_start(n + 1)
+        return end - (2 if rope.slice(end - 2, end) == '\r\n' else 1)
+
+    def offset_at(self, position: Position) -> int:
+        '''
+            convert position to an offset of text, characters past the end
+            of a line are clamped to the line's end
+        '''
+        rope = self._rope
+        if position.line >= rope.line_count:
+            return len(rope)
+        if position.line < 0:
+            return 0
+        start = rope.line_start(position.line)
+        end = self._lineEnd(position.line)
+        character = max(position.character, 0)
+        if not rope.isascii():
+            character = columnToIndex(rope.slice(start, end), character,
+                                      self.encoding)
+        return min(start + character, end)
+
+    def position_at(self, offset: int) -> Position:
+        rope = self._rope
+        offset = min(max(offset, 0), len(rope))
+        line = rope.line_of(offset)
+        start = rope.line_start(line)
+        character = offset - start
+        if not rope.isascii():
+            character = indexToColumn(rope.slice(start, offset), character,
+                                      self.encoding)
+        return Position(line, character)
+
 
 class Document:
-    def __init__(self, uri: str, text: str):
+    '''
+        The editable document. Only the editor worker should call update,
+        handlers on other threads should read through snapshot().
+    '''
+    def __init__(self,
+                 uri: str,
+                 text: str,
+                 encoding: ct.PositionEncodingKind = ct.PositionEncodingKind.UTF16,
+                 version: Optional[int] = None):
         self.uri = uri
-        self.text = text
+        self.encoding = encoding
+        self._snapshot = DocumentSnapshot(uri, Rope(text), version, encoding)
+
+    def snapshot(self) -> DocumentSnapshot:
+        return self._snapshot
+
+    @property
+    def version(self) -> Optional[int]:
+        return self._snapshot.version
+
+    @property
+    def text(self) -> str:
+        return self._snapshot.text
+
+    @text.setter
+    def text(self, text: str):
+        self.setText(text)
+
+    def setText(self, text: str, version: Optional[int] = None):
+        self._snapshot = DocumentSnapshot(self.uri, Rope(text), version,
+                                          self.encoding)
 
     @property
-    def lines(self):
-        return self.text.splitlines(True)
+    def lines(self) -> List[str]:
+        return self._snapshot.lines
 
-    def update(self, changes: List[TextDocumentContentChangeEvent]):
+    @property
+    def lineCount(self) -> int:
+        return self._snapshot.lineCount
+
+    def line(self, n: int) -> str:
+        return self._snapshot.line(n)
+
+    def offset_at(self, position: Position) -> int:
+        return self._snapshot.offset_at(position)
+
+    def position_at(self, offset: int) -> Position:
+        return self._snapshot.position_at(offset)
+
+    def update(self, changes: List[TextDocumentContentChangeEvent],
+               version: Optional[int] = None):
+        '''
+            Apply changes in order, each one to the text the previous one
+            left. The result is published as one new snapshot.
+        '''
+        current = self._snapshot
+        if version is None:
+            version = current.version
         for change in changes:
             if change.range is None:
-                self.text = change.text
+                rope = Rope(change.text)
             else:
-                start = change.range.start
-                end = change.range.end
-                changeText = change.text
-                lines = self.lines
-                if start.line >= len(lines):
-                    self.text += changeText
-                    return
-
-                newIo = io.StringIO()
-                for i, line in enumerate(lines):
-                    if i < start.line:
-                        newIo.write(line)
-                    if i > end.line:
-                        newIo.write(line)
-                    if i == start.line:
-                        newIo.write(line[:start.character])
-                        newIo.write(changeText)
-                    if i == end.line:
-                        newIo.write(line[end.character:])
-                self.text = newIo.getvalue()
+                rope = current._rope.splice(current.offset_at(change.range.start),
+                                            current.offset_at(change.range.end),
+                                            change.text)
+            current = DocumentSnapshot(self.uri, rope, version, self.encoding)
+        if current is self._snapshot:
+            current = DocumentSnapshot(self.uri, current._rope, version,
+                                       self.encoding)
+        self._snapshot = current
+
+
+Stamp = Tuple[int, int, int]  # st_mtime_ns, st_size, st_ino
+
+
+class MappedSnapshot(DocumentSnapshot):
+    '''
+        A DocumentSnapshot of a file that is not open, see mapped.py.
+        version is None, stamp is what the file was stat'ed at when it was
+        mapped.
+    '''
+    __slots__ = ('path', 'stamp')
+
+    def __init__(self, uri: str, path: str, stamp: Stamp, text: MappedText,
+                 encoding: ct.PositionEncodingKind = ct.PositionEncodingKind.UTF16):
+        super().__init__(uri, text, None, encoding)
+        self.path = path
+        self.stamp = stamp
+
+
+def _stamp(stat: os.stat_result) -> Stamp:
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class MappedDocuments:
+    '''
+        The files of the workspace that are not open, mapped on first use.
+        A mapping is reused until the file's mtime, size or inode change, or
+        invalidate() is called for it (on watched-file events). A file
+        truncated in place while a snapshot of it is read can fault on POSIX
+        systems; editors and version control replace files instead, which
+        keeps the old snapshots valid.
+
+        max_open: mappings kept, the least recently used are dropped (and
+                  closed once no snapshot refers to them)
+        check_mtime: stat the file on every get; without it only
+                     invalidate() drops a mapping
+    '''
+    def __init__(self, max_open: int = 256, check_mtime: bool = True):
+        self._max_open = max_open
+        self._check_mtime = check_mtime
+        self._lock = threading.Lock()
+        self._mapped: 'OrderedDict[str, Tuple[str, Stamp, MappedText]]' = OrderedDict()
+
+    def get(self, uri: str,
+            encoding: ct.PositionEncodingKind = ct.PositionEncodingKind.UTF16) -> MappedSnapshot:
+        '''
+            a snapshot of the file uri points to, KeyError if there is none
+        '''
+        key = normalizeUri(uri)
+        with self._lock:
+            entry = self._mapped.get(key)
+            if entry is not None:
+                self._mapped.move_to_end(key)
+        try:
+            if entry is not None and self._check_mtime and _stamp(os.stat(entry[0])) != entry[1]:
+                entry = None
+            if entry is None:
+                entry = self._map(uri)
+        except OSError as e:
+            self.invalidate(uri)
+            raise KeyError(uri) from e
+        with self._lock:
+            self._mapped[key] = entry
+            self._mapped.move_to_end(key)
+            while len(self._mapped) > self._max_open:
+                self._mapped.popitem(last=False)
+        path, stamp, text = entry
+        return MappedSnapshot(uri, path, stamp, text, encoding)
+
+    @staticmethod
+    def _map(uri: str) -> Tuple[str, Stamp, MappedText]:
+        if not normalizeUri(uri).startswith('file:'):
+            raise FileNotFoundError(uri)
+        path = uriTofsPath(uri)
+        with open(path, 'rb') as file:
+            return path, _stamp(os.fstat(file.fileno())), mapFile(file)
+
+    def isCurrent(self, snapshot: MappedSnapshot) -> bool:
+        try:
+            return _stamp(os.stat(snapshot.path)) == snapshot.stamp
+        except OSError:
+            return False
+
+    def invalidate(self, uri: str):
+        with self._lock:
+            self._mapped.pop(normalizeUri(uri), None)
+
+    def clear(self):
+        with self._lock:
+            self._mapped.clear()
 
 
 class WorkSpace:
     def __init__(self):
         self.workspaceFolders: List[WorkSpaceFolder] = []
         self.name = ''
-        self.documents: Dict[Document] = {}
+        # keyed by normalizeUri, a Document keeps the uri the client sent
+        self.documents: Dict[NormalizedUri, Document] = {}
+        # what the documents that are not open read from
+        self.mapped = MappedDocuments()
+        self.positionEncoding = ct.PositionEncodingKind.UTF16
     
     @property
     def rootUri(self) -> Optional[DocumentUri]:
@@ -64,31 +314,62 @@ class WorkSpace:
         self.workspaceFolders.append(folder)  # TODO: check whether the folder already in the list
     
     def removeFolder(self, folder: WorkspaceFolder):
-        try:
-            self.workspaceFolders.remove(folder)
-        except ValueError:
-            logger.exception(f'No such folder. Folder name: {folder.name}')
+        key = normalizeUri(folder.uri)
+        for known in self.workspaceFolders:
+            if normalizeUri(known.uri) == key:
+                self.workspaceFolders.remove(known)
+                return
+        logger.error(f'No such folder. Folder name: {folder.name}')
 
-    def addDocument(self, uri: str, text: str):
-        if uri in self.documents:
-            self.documents[uri].text = text
+    def addDocument(self, uri: str, text: str, version: Optional[int] = None):
+        key = normalizeUri(uri)
+        if key in self.documents:
+            self.documents[key].setText(text, version)
         else:
-            self.documents[uri] = Document(uri, text)
+            self.documents[key] = Document(uri, text, self.positionEncoding,
+                                           version)
 
     def removeDocument(self, uri: str):
         try:
-            self.documents.pop(uri)
+            self.documents.pop(normalizeUri(uri))
         except KeyError:
             logger.error('%s does not exist in the workspace of the server',
                          uri)
 
     def updateDocument(self, uri: str,
-                       changes: List[TextDocumentContentChangeEvent]):
-        if uri not in self.documents:
+                       changes: List[TextDocumentContentChangeEvent],
+                       version: Optional[int] = None):
+        document = self.documents.get(normalizeUri(uri))
+        if document is None:
             logger.error('%s does not exist in the workspace of the server',
                          uri)
         else:
-            self.documents[uri].update(changes)
+            document.update(changes, version)
+
+    def getSnapshot(self, uri: str) -> DocumentSnapshot:
+        '''
+            a consistent view of an open document, safe to read from any
+            thread without locking. A document that is not open is read
+            from disk as a MappedSnapshot, KeyError if there is no such file.
+        '''
+        document = self.documents.get(normalizeUri(uri))
+        if document is None:
+            return self.mapped.get(uri, self.positionEncoding)
+        return document.snapshot()
+
+    def isStale(self, snapshot: DocumentSnapshot) -> bool:
+        '''
+            whether the document changed, or was closed, after snapshot was
+            taken. Handlers can raise JsonRpcContentModified in that case.
+            A MappedSnapshot is stale once the file changes or is opened.
+        '''
+        document = self.documents.get(normalizeUri(snapshot.uri))
+        if isinstance(snapshot, MappedSnapshot):
+            return document is not None or not self.mapped.isCurrent(snapshot)
+        return document is None or document.snapshot() is not snapshot
 
     def getDocumentText(self, uri: str) -> str:
-        return self.documents[uri].text
+        document = self.documents.get(normalizeUri(uri))
+        if document is None:
+            return self.mapped.get(uri).text
+        return document.text